@@ -0,0 +1,291 @@
+"""
+Benchmarks of client construction, response caching and token queries against a local stub of ESI and the SSO.
+
+    python benchmarks/run.py [--tokens 10000] [--latency 0.0] [--only cache_hit ...]
+                             [--save results.json] [--compare baseline.json [--tolerance 0.25]]
+
+Exits with status 1 if any benchmark is slower than the baseline by more than the tolerance.
+"""
+from __future__ import unicode_literals, print_function, division
+from collections import OrderedDict
+import argparse
+import json
+import time
+import sys
+import os
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from stub import StubServer  # noqa: E402
+
+SCOPE_COUNT = 20
+SCOPES_PER_TOKEN = 5
+
+
+def timed(func, iterations):
+    """
+    Runs func repeatedly
+    :return: list of seconds taken by each run
+    """
+    timings = []
+    for _ in range(iterations):
+        started = time.time()
+        func()
+        timings.append(time.time() - started)
+    return timings
+
+
+def summarize(timings):
+    ordered = sorted(timings)
+    return OrderedDict([
+        ('runs', len(ordered)),
+        ('mean', sum(ordered) / len(ordered)),
+        ('p50', ordered[len(ordered) // 2]),
+        ('p95', ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)]),
+        ('min', ordered[0]),
+    ])
+
+
+def bench_client_factory_cold(server, args):
+    from django.core.cache import cache
+    from esi.clients import esi_client_factory, clear_spec_registry
+
+    def build():
+        cache.clear()
+        clear_spec_registry()
+        esi_client_factory()
+    return timed(build, 10)
+
+
+def bench_client_factory_warm(server, args):
+    from esi.clients import esi_client_factory
+    esi_client_factory()
+    return timed(esi_client_factory, 500)
+
+
+def bench_cache_miss(server, args):
+    from django.core.cache import cache
+    from esi.clients import esi_client_factory
+    cache.clear()
+    client = esi_client_factory()
+    character_ids = iter(range(1, 1000000))
+    return timed(lambda: client.Character.get_characters_character_id(character_id=next(character_ids)).result(),
+                 500)
+
+
+def bench_cache_hit(server, args):
+    from esi.clients import esi_client_factory
+    client = esi_client_factory()
+    client.Character.get_characters_character_id(character_id=1).result()
+    return timed(lambda: client.Character.get_characters_character_id(character_id=1).result(), 2000)
+
+
+def bench_cache_miss_large(server, args):
+    from django.core.cache import cache
+    from esi.clients import esi_client_factory
+    client = esi_client_factory()
+    server.config['rows'] = 5000
+
+    def fetch():
+        cache.clear()
+        client.Market.get_markets_region_id_orders(region_id=10000002, order_type='all').result()
+    return timed(fetch, 10)
+
+
+def bench_cache_miss_large_raw(server, args):
+    from django.core.cache import cache
+    from esi.clients import esi_client_factory
+    client = esi_client_factory(raw=True)
+    server.config['rows'] = 5000
+
+    def fetch():
+        cache.clear()
+        client.Market.get_markets_region_id_orders(region_id=10000002, order_type='all').result()
+    return timed(fetch, 10)
+
+
+def bench_cache_hit_large(server, args):
+    from esi.clients import esi_client_factory
+    client = esi_client_factory()
+    server.config['rows'] = 5000
+    client.Market.get_markets_region_id_orders(region_id=10000002, order_type='all').result()
+    return timed(lambda: client.Market.get_markets_region_id_orders(region_id=10000002, order_type='all').result(),
+                 50)
+
+
+def bench_cache_entry_large(server, args):
+    """
+    Times rebuilding the result of a cached market orders page and reports the size of its cache entry
+    """
+    import zlib
+    from esi.cache import response_cache
+    from esi.clients import esi_client_factory
+    client = esi_client_factory()
+    server.config['rows'] = 5000
+    future = client.Market.get_markets_region_id_orders(region_id=10000002, order_type='all')
+    future.result()
+    entry = response_cache.get(future.cache_key)
+    payload, compressed = entry[4], entry[5]
+    sizes = OrderedDict([
+        ('entry_bytes', len(payload)),
+        ('pickled_bytes', len(zlib.decompress(payload)) if compressed else len(payload)),
+    ])
+    return timed(lambda: future._load_entry(entry), 50), sizes
+
+
+def create_tokens(count, expired=False):
+    """
+    Replaces all tokens with count refreshable tokens, each with SCOPES_PER_TOKEN of SCOPE_COUNT scopes
+    """
+    from django.utils import timezone
+    from datetime import timedelta
+    from esi.models import Token, Scope
+    from esi import app_settings
+
+    Token.objects.all().delete()
+    expires_at = timezone.now() + timedelta(seconds=app_settings.ESI_TOKEN_VALID_DURATION)
+    scopes = [Scope.objects.get_or_create(name='esi-benchmark.scope_{0}.v1'.format(i),
+                                          defaults={'help_text': 'Benchmark scope'})[0] for i in range(SCOPE_COUNT)]
+    Token.objects.bulk_create([Token(character_id=90000000 + i, character_name='Character {0}'.format(i),
+                                     character_owner_hash='hash{0}'.format(i), access_token='access{0}'.format(i),
+                                     refresh_token='refresh{0}'.format(i), expires_at=expires_at)
+                               for i in range(count)], batch_size=500)
+    through = Token.scopes.through
+    links = []
+    for i, pk in enumerate(Token.objects.order_by('pk').values_list('pk', flat=True)):
+        links.extend(through(token_id=pk, scope_id=scopes[(i + j * 7) % SCOPE_COUNT].pk)
+                     for j in range(SCOPES_PER_TOKEN))
+    through.objects.bulk_create(links, batch_size=500)
+    Token.objects.all().update_scopes_fingerprints()
+    if expired:
+        Token.objects.update(created=timezone.now() - timedelta(seconds=app_settings.ESI_TOKEN_VALID_DURATION + 60),
+                             expires_at=timezone.now() - timedelta(seconds=60))
+    return scopes
+
+
+def bench_bulk_refresh(server, args):
+    from esi.models import Token
+    create_tokens(args.tokens, expired=True)
+    return timed(lambda: list(Token.objects.all().bulk_refresh()), 1)
+
+
+def bench_get_expired(server, args):
+    from django.utils import timezone
+    from datetime import timedelta
+    from esi.models import Token
+    create_tokens(args.tokens)
+    pks = list(Token.objects.values_list('pk', flat=True)[::10])
+    Token.objects.filter(pk__in=pks).update(expires_at=timezone.now() - timedelta(seconds=60))
+    return timed(lambda: list(Token.objects.all().get_expired().values_list('pk', flat=True)), 50)
+
+
+def bench_require_scopes(server, args):
+    from esi.models import Token
+    scopes = create_tokens(args.tokens)
+    names = [scope.name for scope in scopes[:15:7]]
+    return timed(lambda: list(Token.objects.all().require_scopes(names).values_list('pk', flat=True)), 50)
+
+
+def bench_require_scopes_exact(server, args):
+    from esi.models import Token
+    scopes = create_tokens(args.tokens)
+    names = [scopes[(i * 7) % SCOPE_COUNT].name for i in range(SCOPES_PER_TOKEN)]
+    return timed(lambda: list(Token.objects.all().require_scopes_exact(names).values_list('pk', flat=True)), 20)
+
+
+BENCHMARKS = OrderedDict([
+    ('client_factory_cold', bench_client_factory_cold),
+    ('client_factory_warm', bench_client_factory_warm),
+    ('cache_miss', bench_cache_miss),
+    ('cache_hit', bench_cache_hit),
+    ('cache_miss_large', bench_cache_miss_large),
+    ('cache_miss_large_raw', bench_cache_miss_large_raw),
+    ('cache_hit_large', bench_cache_hit_large),
+    ('cache_entry_large', bench_cache_entry_large),
+    ('bulk_refresh', bench_bulk_refresh),
+    ('get_expired', bench_get_expired),
+    ('require_scopes', bench_require_scopes),
+    ('require_scopes_exact', bench_require_scopes_exact),
+])
+
+
+def setup_django(server):
+    os.environ['ESI_BENCHMARK_URL'] = server.url
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
+    # the stub SSO is served over plain http
+    os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+    import django
+    django.setup()
+    from django.conf import settings
+    from django.core.management import call_command
+    if os.path.exists(settings.DATABASES['default']['NAME']):
+        os.remove(settings.DATABASES['default']['NAME'])
+    call_command('migrate', verbosity=0)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the change in mean time of each benchmark from the baseline
+    :return: names of benchmarks slower than the baseline by more than tolerance
+    """
+    regressions = []
+    for name, summary in results.items():
+        if name not in baseline:
+            continue
+        change = summary['mean'] / baseline[name]['mean'] - 1
+        flag = ''
+        if change > tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('{0:<24} {1:+8.1%}{2}'.format(name, change, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tokens', type=int, default=10000, help='Number of tokens for token benchmarks.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds the stub waits before responding.')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help='Benchmarks to run.')
+    parser.add_argument('--save', help='Write results to this JSON file.')
+    parser.add_argument('--compare', help='JSON file of earlier results to compare against.')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Fraction slower than the baseline considered a regression.')
+    args = parser.parse_args()
+
+    server = StubServer(latency=args.latency).start()
+    setup_django(server)
+
+    results = OrderedDict()
+    print('{0:<24} {1:>6} {2:>10} {3:>10} {4:>10} {5:>10}'.format('benchmark', 'runs', 'mean ms', 'p50 ms',
+                                                                  'p95 ms', 'min ms'))
+    for name, benchmark in BENCHMARKS.items():
+        if args.only and name not in args.only:
+            continue
+        server.config.update(rows=1000, pages=1)
+        timings = benchmark(server, args)
+        # benchmarks may also report measurements other than time, such as sizes
+        timings, extra = timings if isinstance(timings, tuple) else (timings, {})
+        summary = summarize(timings)
+        summary.update(extra)
+        results[name] = summary
+        print('{0:<24} {1:>6} {2:>10.3f} {3:>10.3f} {4:>10.3f} {5:>10.3f}'.format(
+            name, summary['runs'], summary['mean'] * 1000, summary['p50'] * 1000, summary['p95'] * 1000,
+            summary['min'] * 1000))
+        for measure, value in extra.items():
+            print('{0:<24} {1}'.format('  ' + measure, value))
+    print('{0} requests served by the stub.'.format(server.requests))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        print()
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
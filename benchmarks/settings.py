@@ -0,0 +1,35 @@
+"""
+Django settings for the benchmarks. ESI and SSO URLs are pointed at the stub server by run.py.
+"""
+import os
+import tempfile
+
+SECRET_KEY = 'benchmarks'
+DEBUG = False
+USE_TZ = True
+
+INSTALLED_APPS = [
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'esi',
+]
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(tempfile.gettempdir(), 'esi_benchmarks.sqlite3'),
+    }
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    }
+}
+
+ESI_SSO_CLIENT_ID = 'benchmark'
+ESI_SSO_CLIENT_SECRET = 'benchmark'
+ESI_SSO_CALLBACK_URL = 'http://localhost/sso/callback'
+ESI_API_URL = os.environ['ESI_BENCHMARK_URL']
+ESI_SSO_BASE_URL = ESI_API_URL + 'oauth'
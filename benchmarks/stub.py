@@ -0,0 +1,151 @@
+"""
+Local stand-in for ESI and the EVE SSO, serving the recorded spec in swagger.json.
+"""
+from __future__ import unicode_literals
+from email.utils import formatdate
+from hashlib import md5
+import threading
+import json
+import time
+import os
+import re
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlsplit, parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlsplit, parse_qs
+
+SPEC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'swagger.json')
+
+RANGES = ('station', 'region', 'solarsystem', '1', '5', '10', '40')
+
+
+def build_orders(page, rows):
+    return [{
+        'order_id': page * 10000000 + i,
+        'type_id': 34 + (i * 7919) % 40000,
+        'location_id': 60003760 + i % 50,
+        'system_id': 30000142 + i % 20,
+        'volume_total': 1000 + i % 5000,
+        'volume_remain': 500 + i % 500,
+        'min_volume': 1,
+        'price': round(((i * 2654435761) % 10 ** 9) / 1000.0, 2),
+        'is_buy_order': i % 3 == 0,
+        'duration': 90,
+        'issued': '2018-01-%02dT%02d:%02d:%02dZ' % (1 + i % 28, i % 24, i % 60, (i * 7) % 60),
+        'range': RANGES[i % len(RANGES)],
+    } for i in range(rows)]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # send headers and body together, avoiding delayed ACK stalls on kept-alive connections
+    wbufsize = -1
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def send_json(self, body, status=200, headers=None, cache=True):
+        raw = json.dumps(body).encode('utf-8')
+        etag = '"{0}"'.format(md5(raw).hexdigest())
+        if cache and self.headers.get('If-None-Match') == etag:
+            status, raw = 304, b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(raw)))
+        if cache:
+            self.send_header('ETag', etag)
+            self.send_header('Expires', formatdate(time.time() + self.config['expires'], usegmt=True))
+        self.send_header('X-ESI-Error-Limit-Remain', '100')
+        self.send_header('X-ESI-Error-Limit-Reset', '60')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def handle_request(self):
+        self.server.requests += 1
+        time.sleep(self.config['latency'])
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+
+        if url.path == '/oauth/token':
+            form = parse_qs(self.read_body().decode('utf-8'))
+            if form.get('refresh_token', [''])[0].startswith('invalid'):
+                return self.send_json({'error': 'invalid_grant'}, status=400, cache=False)
+            self.server.token_count += 1
+            return self.send_json({
+                'access_token': 'access{0}'.format(self.server.token_count),
+                'refresh_token': 'refresh{0}'.format(self.server.token_count),
+                'token_type': 'Bearer',
+                'expires_in': 1200,
+            }, cache=False)
+        if url.path == '/oauth/verify':
+            return self.send_json({
+                'CharacterID': 90000001,
+                'CharacterName': 'Benchmark Character',
+                'ExpiresOn': '2018-01-01T00:20:00',
+                'Scopes': 'esi-wallet.read_character_wallet.v1',
+                'TokenType': 'Character',
+                'CharacterOwnerHash': 'benchmarkhash',
+            }, cache=False)
+
+        match = re.match(r'^/(\w+)/swagger\.json$', url.path)
+        if match:
+            spec = json.loads(self.server.spec.replace('HOST', '{0}:{1}'.format(*self.server.server_address)))
+            spec['basePath'] = '/' + match.group(1)
+            return self.send_json(spec, cache=False)
+        if re.match(r'^/\w+/characters/\d+/wallet/$', url.path):
+            return self.send_json(1234567.89)
+        match = re.match(r'^/\w+/characters/(\d+)/$', url.path)
+        if match:
+            return self.send_json({'name': 'Character {0}'.format(match.group(1)), 'corporation_id': 1000001,
+                                   'birthday': '2015-03-24T11:37:00Z'})
+        if re.match(r'^/\w+/markets/\d+/orders/$', url.path):
+            page = int(query.get('page', ['1'])[0])
+            return self.send_json(build_orders(page, self.config['rows']),
+                                  headers={'X-Pages': str(self.config['pages'])})
+        if url.path.endswith('/universe/names/'):
+            ids = json.loads(self.read_body().decode('utf-8'))
+            return self.send_json([{'id': i, 'name': 'Name {0}'.format(i), 'category': 'character'} for i in ids],
+                                  cache=False)
+        self.send_json({'error': 'Not found'}, status=404, cache=False)
+
+    do_GET = do_POST = handle_request
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """
+    Serves ESI and SSO endpoints on localhost from a background thread.
+    Adjust `config` to change the simulated latency, the expiry of responses and the size of market order pages.
+    """
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, expires=300, pages=1, rows=1000):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        self.config = {'latency': latency, 'expires': expires, 'pages': pages, 'rows': rows}
+        self.requests = 0
+        self.token_count = 0
+        with open(SPEC_PATH, 'r') as f:
+            self.spec = f.read()
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}/'.format(*self.server_address)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
@@ -0,0 +1,303 @@
+"""
+asyncio support for ESI clients.
+Requires Python 3.5+ and aiohttp, installed with the `async` extra.
+"""
+from __future__ import unicode_literals
+from django.core.exceptions import ImproperlyConfigured
+from esi.clients import CachingHttpFuture, TokenAuthenticator, EsiClient, BufferedResponse, get_registered_spec, \
+    copy_request_for_page, get_page_count, with_datasource
+from esi.cache import response_cache
+from esi.retry import RetryTracker
+from esi import app_settings, throttle
+import requests
+import asyncio
+import weakref
+import time
+from itertools import chain
+import logging
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+logger = logging.getLogger(__name__)
+
+_sessions = weakref.WeakKeyDictionary()
+
+
+def get_async_session():
+    """
+    Retrieves the aiohttp session used for all ESI requests on the running event loop, creating it if needed.
+    :return: :class:`aiohttp.ClientSession`
+    """
+    loop = asyncio.get_event_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=app_settings.ESI_ASYNC_MAX_CONNECTIONS,
+                                         limit_per_host=app_settings.ESI_ASYNC_MAX_CONNECTIONS)
+        # the session is shared between tokens so must not carry state between their requests
+        session = aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar())
+        _sessions[loop] = session
+    return session
+
+
+async def close_async_session():
+    """
+    Closes the aiohttp session of the running event loop. Call before the loop is closed.
+    """
+    session = _sessions.pop(asyncio.get_event_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+async def run_sync(func, *args):
+    """
+    Runs blocking code such as cache or database access in the default executor.
+    """
+    return await asyncio.get_event_loop().run_in_executor(None, func, *args)
+
+
+class AsyncTokenAuthenticator(TokenAuthenticator):
+    """
+    TokenAuthenticator which refreshes expired tokens without blocking the event loop.
+    Concurrent requests with the same token wait on a single refresh.
+    """
+    def __init__(self, token=None, datasource=None):
+        super(AsyncTokenAuthenticator, self).__init__(token=token, datasource=datasource)
+        self._refresh_lock = asyncio.Lock()
+
+    async def apply_async(self, request):
+        if self.token and self.token.expired and self.token.can_refresh:
+            async with self._refresh_lock:
+                # another request may have refreshed while we waited
+                if self.token.expired:
+                    await run_sync(self._refresh_token)
+        return self.apply(request)
+
+
+class AsyncCachingHttpFuture(CachingHttpFuture):
+    """
+    Awaitable counterpart of :class:`esi.clients.CachingHttpFuture`.
+    The request is only sent when `result()` is awaited.
+    Cache entries are shared with synchronous clients.
+    """
+    def __init__(self, http_client, request, misc_options, operation=None, response_callbacks=None,
+                 also_return_response=False):
+        self.http_client = http_client
+        self.misc_options = misc_options
+        super(AsyncCachingHttpFuture, self).__init__(
+            _PendingRequest(request), BufferedResponse, operation=operation,
+            response_callbacks=response_callbacks, also_return_response=also_return_response)
+
+    @property
+    def request(self):
+        return self.future.request
+
+    def _build_timeout(self, timeout):
+        return aiohttp.ClientTimeout(
+            total=timeout or self.misc_options.get('timeout'),
+            connect=self.misc_options.get('connect_timeout'),
+        )
+
+    async def _send(self, timeout=None):
+        """
+        Applies authentication, sends the request and reads the full response body, retrying transient failures
+        :return: :class:`esi.aio.BufferedResponse`
+        """
+        request = self.request
+        if self.http_client.authenticator and self.http_client.authenticator.matches(request.url):
+            with self._timed('auth'):
+                await self.http_client.authenticator.apply_async(request)
+        headers = {k: str(v) for k, v in request.headers.items() if v is not None}
+        retries = RetryTracker(request.method)
+        while True:
+            with self._timed('wait'):
+                delay = await run_sync(throttle.get_throttle_delay)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            try:
+                incoming_response = await self._request(request, headers, timeout)
+            except aiohttp.ClientConnectionError:
+                delay = await run_sync(retries.backoff)
+                if delay is None:
+                    self.retries = retries.attempts
+                    raise
+            else:
+                await run_sync(throttle.record_error_limit, incoming_response)
+                delay = await run_sync(retries.backoff, incoming_response)
+                if delay is None:
+                    self._record_response(incoming_response, retries.attempts)
+                    return incoming_response
+            with self._timed('wait'):
+                await asyncio.sleep(delay)
+
+    async def _request(self, request, headers, timeout):
+        session = get_async_session()
+        started = time.time()
+        async with session.request(request.method, request.url, params=request.params, headers=headers,
+                                   data=request.data or None, json=request.json,
+                                   timeout=self._build_timeout(timeout)) as response:
+            ttfb = time.time() - started
+            body = await response.read()
+        self._record_network_timings(started, ttfb)
+        return self.response_adapter(response.status, response.reason, response.headers, body)
+
+    async def _fetch(self, timeout=None):
+        incoming_response = await self._send(timeout=timeout)
+        if self.operation is None:
+            return incoming_response, incoming_response
+        return self._unmarshal(incoming_response), incoming_response
+
+    async def _wait_for_fetch(self):
+        deadline = time.time() + app_settings.ESI_CACHE_LOCK_TIMEOUT
+        while time.time() < deadline:
+            await asyncio.sleep(app_settings.ESI_CACHE_LOCK_POLL_INTERVAL)
+            done, entry = await run_sync(self._poll_fetched_entry)
+            if done:
+                return entry
+        return None
+
+    async def _fetch_and_store(self, entry, timeout=None):
+        self._add_validator(entry)
+        incoming_response = await self._send(timeout=timeout)
+        if entry and incoming_response.status_code == 304:
+            self._record_cache_status('revalidated')
+            entry = self._renew_entry(entry, incoming_response)
+            result, response = self._load_entry(entry)
+        else:
+            self._record_cache_status('miss')
+            result, response = self._unmarshal(incoming_response), incoming_response
+            entry = self._build_entry(result, incoming_response)
+        await run_sync(self._store, entry)
+        return result, response
+
+    async def _cached_result(self, timeout=None):
+        with self._timed('cache_lookup'):
+            entry = await run_sync(response_cache.get, self.cache_key)
+        if entry and self._entry_is_fresh(entry):
+            self._record_cache_status('hit')
+            return self._load_entry(entry)
+
+        if entry and self._can_serve_stale(entry) and await run_sync(self._queue_refresh):
+            self._record_cache_status('stale')
+            return self._load_entry(entry)
+
+        if not await run_sync(self._acquire_fetch_lock):
+            if entry and self._can_serve_stale(entry):
+                self._record_cache_status('stale')
+                return self._load_entry(entry)
+            with self._timed('cache_wait'):
+                fetched = await self._wait_for_fetch()
+            if fetched:
+                self._record_cache_status('hit')
+                return self._load_entry(fetched)
+        try:
+            return await self._fetch_and_store(entry, timeout=timeout)
+        finally:
+            await run_sync(self._release_fetch_lock)
+
+    async def result(self, timeout=None):
+        started = time.time()
+        try:
+            if self._is_cacheable():
+                result, response = await self._cached_result(timeout=timeout)
+            else:
+                result, response = await self._fetch(timeout=timeout)
+        except Exception as e:
+            if self.operation is not None:
+                self._request_finished(started, getattr(e, 'status_code', None))
+            raise
+        if self.operation is not None:
+            self._request_finished(started, response.status_code)
+            response.timings = self.timings
+
+        if self.also_return_response:
+            return result, response
+        return result
+
+    async def result_all_pages(self, merge=True, max_workers=None, timeout=None):
+        """
+        Retrieves every page of a paginated operation, as with :meth:`esi.clients.CachingHttpFuture.result_all_pages`
+        :param merge: Return a single list of all items if True, otherwise a list of the result of each page.
+        :param max_workers: Maximum number of pages retrieved at once. Defaults to ESI_PAGE_MAX_WORKERS.
+        :return: list of items, or list of page results in page order
+        """
+        _also_return_response = self.also_return_response
+        self.also_return_response = True
+        try:
+            first, response = await self.result(timeout=timeout)
+        finally:
+            self.also_return_response = _also_return_response
+        semaphore = asyncio.Semaphore(max_workers or app_settings.ESI_PAGE_MAX_WORKERS)
+
+        async def fetch(page):
+            future = self.__class__(self.http_client, copy_request_for_page(self.request, page), self.misc_options,
+                                    operation=self.operation, response_callbacks=self.response_callbacks)
+            future.token = self.token
+            future.raw = self.raw
+            async with semaphore:
+                return await future.result(timeout=timeout)
+
+        results = [first] + list(await asyncio.gather(*[fetch(page) for page in
+                                                        range(2, get_page_count(response) + 1)]))
+        if merge:
+            return list(chain.from_iterable(results))
+        return results
+
+
+class _PendingRequest(object):
+    """
+    Stands in for a FutureAdapter so the request is reachable as `future.request`, as with synchronous futures.
+    """
+    def __init__(self, request):
+        self.request = request
+
+
+class AsyncEsiRequestsClient(object):
+    """
+    Http client for :class:`esi.clients.EsiClient` returning awaitable futures.
+    Requests are sent over the shared aiohttp session of the running event loop.
+    """
+    def __init__(self, authenticator=None, client_kwargs=None, raw=False):
+        self.authenticator = authenticator
+        self.client_kwargs = client_kwargs
+        self.raw = raw
+
+    def request(self, request_params, operation=None, response_callbacks=None, also_return_response=False):
+        request_params = with_datasource(request_params) if operation is not None else dict(request_params)
+        misc_options = {key: request_params.pop(key) for key in ('timeout', 'connect_timeout')
+                        if key in request_params}
+        request = requests.Request(**request_params)
+        if self.authenticator and self.authenticator.matches(request.url):
+            # datasource is part of the cache key so is needed now, the token is applied when sending
+            request.params['datasource'] = self.authenticator.datasource or app_settings.ESI_API_DATASOURCE
+        future = AsyncCachingHttpFuture(self, request, misc_options, operation=operation,
+                                        response_callbacks=response_callbacks,
+                                        also_return_response=also_return_response)
+        future.token = getattr(self.authenticator, 'token', None)
+        future.raw = self.raw
+        return future
+
+
+async def async_esi_client_factory(token=None, datasource=None, spec_file=None, version=None, raw=False, **kwargs):
+    """
+    Generates an ESI client whose operations return awaitable futures:
+
+        client = await async_esi_client_factory(token=my_token)
+        result = await client.Character.get_characters_character_id(character_id=1).result()
+
+    Accepts the same arguments as :func:`esi.clients.esi_client_factory`.
+    :return: :class:`esi.clients.EsiClient`
+    """
+    if aiohttp is None:
+        raise ImproperlyConfigured('aiohttp is required for asyncio ESI clients. '
+                                   'Install with `pip install adarnauth-esi[async]`.')
+    client = AsyncEsiRequestsClient(
+        client_kwargs=dict(datasource=datasource, spec_file=spec_file, version=version, raw=raw, **kwargs), raw=raw)
+    if token or datasource:
+        client.authenticator = AsyncTokenAuthenticator(token=token, datasource=datasource)
+
+    spec = await run_sync(lambda: get_registered_spec(version=version, spec_file=spec_file, **kwargs))
+    return EsiClient(spec, http_client=client)
@@ -22,6 +22,25 @@ ESI_ALWAYS_CREATE_TOKEN = getattr(settings, 'ESI_ALWAYS_CREATE_TOKEN', False)
 # Disable to stop caching endpoint responses
 ESI_CACHE_RESPONSE = getattr(settings, 'ESI_CACHE_RESPONSE', True)
 
+# Cached results of at least this many bytes, once pickled, are compressed. Set to 0 to disable.
+ESI_CACHE_COMPRESS_THRESHOLD = int(getattr(settings, 'ESI_CACHE_COMPRESS_THRESHOLD', 1024))
+
+# Seconds to keep cached responses past expiry so they can be revalidated by ETag. Set to 0 to disable.
+ESI_CACHE_ETAG_DURATION = int(getattr(settings, 'ESI_CACHE_ETAG_DURATION', 3600))
+
+# Seconds past expiry to keep serving cached responses while a celery task refreshes them. Set to 0 to disable.
+ESI_CACHE_STALE_DURATION = int(getattr(settings, 'ESI_CACHE_STALE_DURATION', 0))
+
+# Keep recently used cached responses and spec dicts in process memory too, saving trips to the cache backend
+ESI_LOCAL_CACHE = getattr(settings, 'ESI_LOCAL_CACHE', False)
+ESI_LOCAL_CACHE_MAX_ENTRIES = int(getattr(settings, 'ESI_LOCAL_CACHE_MAX_ENTRIES', 1000))
+ESI_LOCAL_CACHE_MAX_BYTES = int(getattr(settings, 'ESI_LOCAL_CACHE_MAX_BYTES', 50 * 1024 * 1024))
+
+# Only let one process at a time retrieve an uncached response, others wait for it to be cached
+ESI_CACHE_SINGLE_FLIGHT = getattr(settings, 'ESI_CACHE_SINGLE_FLIGHT', True)
+ESI_CACHE_LOCK_TIMEOUT = int(getattr(settings, 'ESI_CACHE_LOCK_TIMEOUT', 10))  # seconds to hold the lock or wait
+ESI_CACHE_LOCK_POLL_INTERVAL = float(getattr(settings, 'ESI_CACHE_LOCK_POLL_INTERVAL', 0.1))  # seconds
+
 # These probably won't ever change. Override if needed.
 ESI_API_URL = getattr(settings, 'ESI_API_URL', 'https://esi.tech.ccp.is/')
 ESI_OAUTH_LOGIN_URL = getattr(settings, 'ESI_SSO_LOGIN_URL', ESI_OAUTH_URL + "/authorize/")
@@ -29,3 +48,84 @@ ESI_TOKEN_URL = getattr(settings, 'ESI_CODE_EXCHANGE_URL', ESI_OAUTH_URL + "/tok
 ESI_TOKEN_VERIFY_URL = getattr(settings, 'ESI_TOKEN_EXCHANGE_URL', ESI_OAUTH_URL + "/verify")
 ESI_TOKEN_VALID_DURATION = int(getattr(settings, 'ESI_TOKEN_VALID_DURATION', 1200))
 ESI_SPEC_CACHE_DURATION = int(getattr(settings, 'ESI_SPEC_CACHE_DURATION', 3600))
+
+# Path to a spec bundle written by the esi_spec_bundle management command. Spec versions it contains
+# are loaded from it instead of ESI.
+ESI_SPEC_BUNDLE = getattr(settings, 'ESI_SPEC_BUNDLE', None)
+
+# Build specs when Django starts rather than on first use, including any resource versions given
+# in the form {'Character': 'v4'}
+ESI_SPEC_WARM_UP = getattr(settings, 'ESI_SPEC_WARM_UP', False)
+ESI_SPEC_WARM_UP_RESOURCE_VERSIONS = dict(getattr(settings, 'ESI_SPEC_WARM_UP_RESOURCE_VERSIONS', {}))
+
+# Only build each operation of a spec when first used, rather than every operation when the spec is built
+ESI_LAZY_SPEC = getattr(settings, 'ESI_LAZY_SPEC', False)
+
+# Connection pooling for requests to ESI, shared by all clients in a process
+ESI_CONNECTION_POOL_SIZE = int(getattr(settings, 'ESI_CONNECTION_POOL_SIZE', 10))  # number of hosts to keep pools for
+ESI_CONNECTION_POOL_MAXSIZE = int(getattr(settings, 'ESI_CONNECTION_POOL_MAXSIZE', 10))  # connections kept per host
+
+# Maximum simultaneous connections held by asyncio clients on each event loop
+ESI_ASYNC_MAX_CONNECTIONS = int(getattr(settings, 'ESI_ASYNC_MAX_CONNECTIONS', 100))
+
+# Maximum number of pages of a paginated operation retrieved at once
+ESI_PAGE_MAX_WORKERS = int(getattr(settings, 'ESI_PAGE_MAX_WORKERS', 5))
+
+# Maximum number of tokens refreshed at once by bulk_refresh() and the cleanup_token task
+ESI_TOKEN_REFRESH_MAX_WORKERS = int(getattr(settings, 'ESI_TOKEN_REFRESH_MAX_WORKERS', 10))
+
+# Number of refreshed tokens saved, or failed tokens deleted, per query during bulk refreshes
+ESI_TOKEN_REFRESH_BATCH_SIZE = int(getattr(settings, 'ESI_TOKEN_REFRESH_BATCH_SIZE', 500))
+
+# Proactive token refresh by the refresh_expiring_tokens task, scheduled every ESI_TOKEN_REFRESH_INTERVAL seconds.
+# Tokens expiring within ESI_TOKEN_REFRESH_AHEAD seconds are refreshed, at most ESI_TOKEN_REFRESH_MAX_PER_RUN per run,
+# in chunks of ESI_TOKEN_REFRESH_CHUNK_SIZE spread over the interval.
+ESI_TOKEN_REFRESH_INTERVAL = int(getattr(settings, 'ESI_TOKEN_REFRESH_INTERVAL', 60))
+ESI_TOKEN_REFRESH_AHEAD = int(getattr(settings, 'ESI_TOKEN_REFRESH_AHEAD', 300))
+ESI_TOKEN_REFRESH_MAX_PER_RUN = int(getattr(settings, 'ESI_TOKEN_REFRESH_MAX_PER_RUN', 1000))
+ESI_TOKEN_REFRESH_CHUNK_SIZE = int(getattr(settings, 'ESI_TOKEN_REFRESH_CHUNK_SIZE', 50))
+
+# Slow requests once fewer than ESI_ERROR_LIMIT_SLOWDOWN errors remain in the ESI error limit window,
+# and pause them until the window resets at ESI_ERROR_LIMIT_PAUSE or fewer. Disable to ignore the error limit.
+ESI_ERROR_LIMIT_THROTTLE = getattr(settings, 'ESI_ERROR_LIMIT_THROTTLE', True)
+ESI_ERROR_LIMIT_SLOWDOWN = int(getattr(settings, 'ESI_ERROR_LIMIT_SLOWDOWN', 50))
+ESI_ERROR_LIMIT_PAUSE = int(getattr(settings, 'ESI_ERROR_LIMIT_PAUSE', 10))
+
+# Number of times an idempotent request is retried after a connection error or one of ESI_RETRY_STATUS_CODES.
+# Retries wait with exponential backoff from ESI_RETRY_BACKOFF seconds up to ESI_RETRY_BACKOFF_MAX,
+# or as long as requested by a Retry-After header.
+ESI_RETRIES = int(getattr(settings, 'ESI_RETRIES', 3))
+ESI_RETRY_STATUS_CODES = tuple(getattr(settings, 'ESI_RETRY_STATUS_CODES', (502, 503, 504)))
+ESI_RETRY_BACKOFF = float(getattr(settings, 'ESI_RETRY_BACKOFF', 0.5))
+ESI_RETRY_BACKOFF_MAX = float(getattr(settings, 'ESI_RETRY_BACKOFF_MAX', 30))
+
+# Maximum number of retries made by each process within ESI_RETRY_BUDGET_PERIOD seconds
+ESI_RETRY_BUDGET = int(getattr(settings, 'ESI_RETRY_BUDGET', 30))
+ESI_RETRY_BUDGET_PERIOD = int(getattr(settings, 'ESI_RETRY_BUDGET_PERIOD', 60))
+
+# Seconds the ID resolution batchers wait for concurrent lookups to join a batch,
+# and how long each resolved ID or name is cached
+ESI_ID_BATCH_WINDOW = float(getattr(settings, 'ESI_ID_BATCH_WINDOW', 0.05))
+ESI_ID_BATCH_CACHE_DURATION = int(getattr(settings, 'ESI_ID_BATCH_CACHE_DURATION', 86400))
+
+# Collect per-operation totals of ESI requests in esi.metrics.aggregator
+ESI_METRICS = getattr(settings, 'ESI_METRICS', False)
+
+# Send ESI request metrics to this statsd server as they happen
+ESI_METRICS_STATSD_HOST = getattr(settings, 'ESI_METRICS_STATSD_HOST', None)
+ESI_METRICS_STATSD_PORT = int(getattr(settings, 'ESI_METRICS_STATSD_PORT', 8125))
+ESI_METRICS_STATSD_PREFIX = getattr(settings, 'ESI_METRICS_STATSD_PREFIX', 'esi')
+
+# Fraction of requests, from 0 to 1, whose time spent in each phase is recorded in the `timings` of their
+# future and response. Calls taking at least ESI_SLOW_CALL_THRESHOLD seconds are logged, with their timings
+# if sampled.
+ESI_TIMING_SAMPLE_RATE = float(getattr(settings, 'ESI_TIMING_SAMPLE_RATE', 0))
+ESI_SLOW_CALL_THRESHOLD = getattr(settings, 'ESI_SLOW_CALL_THRESHOLD', None)
+if ESI_SLOW_CALL_THRESHOLD is not None:
+    ESI_SLOW_CALL_THRESHOLD = float(ESI_SLOW_CALL_THRESHOLD)
+
+# Bytes read from the response at a time by stream_result() and stream_all_pages()
+ESI_STREAM_CHUNK_SIZE = int(getattr(settings, 'ESI_STREAM_CHUNK_SIZE', 65536))
+
+# Function decoding the JSON of raw requests, or its dotted path. Defaults to orjson or ujson if installed.
+ESI_JSON_DECODER = getattr(settings, 'ESI_JSON_DECODER', None)
@@ -9,4 +9,8 @@ class EsiConfig(AppConfig):
 
     def ready(self):
         super(EsiConfig, self).ready()
-        from esi import checks
\ No newline at end of file
+        from esi import checks, app_settings, metrics
+        metrics.setup()
+        if app_settings.ESI_SPEC_WARM_UP:
+            from esi.clients import warm_up_specs
+            warm_up_specs()
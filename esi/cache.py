@@ -0,0 +1,154 @@
+from __future__ import unicode_literals
+from django.core.cache import cache
+from collections import Counter, OrderedDict
+from esi import app_settings
+import threading
+import pickle
+import time
+
+
+class Statistics(object):
+    """
+    Thread-safe named counters
+    """
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counts[name] += amount
+
+    def as_dict(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+# counts of "local_hit", "local_miss", "shared_hit" and "shared_miss" lookups in this process
+tier_stats = Statistics()
+
+
+class LocalCache(object):
+    """
+    Thread-safe in-process cache which evicts the least recently used values
+    once it holds more than max_entries values or max_bytes bytes.
+    """
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()  # key: (value, expiry timestamp, size)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self.size -= size
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value, expires_at, size = self._entries.pop(key)
+            except KeyError:
+                return None
+            if expires_at <= time.time():
+                self.size -= size
+                return None
+            # re-insert as most recently used
+            self._entries[key] = (value, expires_at, size)
+            return value
+
+    def set(self, key, value, timeout, size):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if timeout <= 0 or size > self.max_bytes:
+                return
+            self._entries[key] = (value, time.time() + timeout, size)
+            self.size += size
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+def _build_local_cache():
+    if app_settings.ESI_LOCAL_CACHE:
+        return LocalCache(app_settings.ESI_LOCAL_CACHE_MAX_ENTRIES, app_settings.ESI_LOCAL_CACHE_MAX_BYTES)
+    return None
+
+
+# shared by all TieredCaches, None if disabled
+local_cache = _build_local_cache()
+
+
+class TieredCache(object):
+    """
+    Django cache with the process-wide :class:`LocalCache` in front of it, when enabled by ESI_LOCAL_CACHE.
+    Values are only kept locally for as long as `ttl(value)` seconds, so changes made by other processes
+    are seen once that has passed.
+    """
+    def __init__(self, ttl, sizeof, backend=None):
+        """
+        :param ttl: callable returning the seconds a value may be kept locally
+        :param sizeof: callable returning the approximate size of a value in bytes
+        :param backend: Django cache to put the local cache in front of, defaults to the default cache
+        """
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.backend = backend or cache
+
+    def _set_local(self, key, value):
+        local_cache.set(key, value, self.ttl(value), self.sizeof(value))
+
+    def get(self, key):
+        if local_cache is not None:
+            value = local_cache.get(key)
+            if value is not None:
+                tier_stats.incr('local_hit')
+                return value
+            tier_stats.incr('local_miss')
+        value = self.backend.get(key)
+        tier_stats.incr('shared_miss' if value is None else 'shared_hit')
+        if value is not None and local_cache is not None:
+            self._set_local(key, value)
+        return value
+
+    def set(self, key, value, timeout):
+        self.backend.set(key, value, timeout)
+        if local_cache is not None:
+            self._set_local(key, value)
+
+    def get_or_set(self, key, default, timeout):
+        value = self.get(key)
+        if value is None:
+            value = default() if callable(default) else default
+            self.set(key, value, timeout)
+        return value
+
+    def delete(self, key):
+        self.backend.delete(key)
+        if local_cache is not None:
+            local_cache.delete(key)
+
+
+# cached ESI responses are kept locally until they expire
+response_cache = TieredCache(ttl=lambda entry: entry[0] - time.time(), sizeof=lambda entry: len(entry[4]))
+
+# spec dicts are only pickled to measure them when first kept locally
+spec_cache = TieredCache(ttl=lambda spec_dict: app_settings.ESI_SPEC_CACHE_DURATION,
+                         sizeof=lambda spec_dict: len(pickle.dumps(spec_dict, pickle.HIGHEST_PROTOCOL)))
@@ -1,92 +1,890 @@
 from __future__ import unicode_literals
-from bravado.client import SwaggerClient, CONFIG_DEFAULTS
+from bravado.client import SwaggerClient, ResourceDecorator, CallableOperation, CONFIG_DEFAULTS, \
+    REQUEST_OPTIONS_DEFAULTS, construct_request
 from bravado import requests_client
 from bravado.swagger_model import Loader
-from bravado.http_future import HttpFuture
-from bravado_core.spec import Spec
+from bravado.http_future import HttpFuture, reraise_errors, unmarshal_response, raise_on_expected, \
+    raise_on_unexpected
+from bravado_core.spec import Spec, build_api_serving_url
+from bravado_core.resource import Resource
+from bravado_core.response import IncomingResponse, get_response_spec
+from bravado_core.unmarshal import unmarshal_schema_object
+from bravado_core.validate import validate_schema_object
+from bravado.exception import HTTPNotFound
+from bravado.warning import warn_for_deprecated_op
 from esi.errors import TokenExpiredError
-from esi import app_settings
+from esi import app_settings, signals, throttle
+from esi.cache import Statistics, response_cache, spec_cache
+from esi.retry import RetryTracker
 from django.core.cache import cache
+from django.utils.module_loading import import_string
 from datetime import datetime
 from hashlib import md5
+from contextlib import contextmanager
+from itertools import chain
+from uuid import uuid4
+from multiprocessing.pool import ThreadPool
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+import requests
+import threading
+import os
+import time
 import json
+import math
+import codecs
+import random
+import zlib
+import pickle
+import logging
+
+try:
+    from bravado_core.util import sanitize_name
+except ImportError:
+    # older bravado-core doesn't rename resources
+    def sanitize_name(name):
+        return name
 
 try:
     import urlparse
 except ImportError:  # py3
     from urllib import parse as urlparse
 
+try:
+    from cookielib import DefaultCookiePolicy
+except ImportError:  # py3
+    from http.cookiejar import DefaultCookiePolicy
+
+
+logger = logging.getLogger(__name__)
 
 SPEC_CONFIG = {'use_models': False}
 
 
+# phases of a request timed for ESI_TIMING_SAMPLE_RATE of requests, in the order they occur. "auth" includes
+# refreshing expired tokens, "wait" covers delays for the error limit and retries, and "cache_wait" waiting for
+# another process to retrieve the response
+TIMING_PHASES = ('auth', 'cache_lookup', 'cache_wait', 'cache_load', 'wait', 'ttfb', 'download', 'unmarshal',
+                 'cache_store', 'total')
+
+# counts of "hit", "miss", "revalidated" and "stale" cached responses in this process
+cache_stats = Statistics()
+
+
+# response headers kept in cache entries
+CACHED_HEADERS = ('Content-Type', 'Expires', 'ETag', 'Last-Modified', 'X-Pages')
+
+
+_json_decoder = json.JSONDecoder()
+_whitespace = ' \t\n\r'
+
+
+def iter_json_array(chunks):
+    """
+    Decodes the items of a JSON array as its text is received, without holding the whole document
+    :param chunks: iterable of bytes of UTF-8 encoded JSON
+    :return: generator of decoded items
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer = ''
+    position = 0
+    finished = False
+    expecting = '['  # next token: "[", an item (or "]" after "["), or "," / "]" after an item
+
+    while True:
+        while position < len(buffer) and buffer[position] in _whitespace:
+            position += 1
+        if position < len(buffer):
+            char = buffer[position]
+            if expecting == '[':
+                if char != '[':
+                    raise ValueError('Expected a JSON array')
+                position += 1
+                expecting = 'first'
+                continue
+            if expecting in ('first', 'separator') and char == ']':
+                return
+            if expecting == 'separator':
+                if char != ',':
+                    raise ValueError('Expected "," or "]" at position {0}'.format(position))
+                position += 1
+                expecting = 'item'
+                continue
+            try:
+                item, end = _json_decoder.raw_decode(buffer, position)
+            except ValueError:
+                if finished:
+                    raise
+            else:
+                # an item not yet followed by "," or "]" may be cut short, e.g. a number
+                following = end
+                while following < len(buffer) and buffer[following] in _whitespace:
+                    following += 1
+                if finished or (following < len(buffer) and buffer[following] in ',]'):
+                    yield item
+                    position = end
+                    expecting = 'separator'
+                    continue
+        elif finished:
+            raise ValueError('Unexpected end of JSON array')
+
+        # more text is needed to continue
+        buffer = buffer[position:]
+        position = 0
+        try:
+            chunk = next(chunks)
+            buffer += decoder.decode(chunk)
+        except StopIteration:
+            buffer += decoder.decode(b'', final=True)
+            finished = True
+
+
+_json_decoder_func = None
+
+
+def get_json_decoder():
+    """
+    Finds the function decoding response bodies of raw requests: ESI_JSON_DECODER if set,
+    otherwise orjson or ujson if installed, falling back to the json module
+    :return: callable taking bytes and returning the decoded JSON
+    """
+    global _json_decoder_func
+    if _json_decoder_func is None:
+        if app_settings.ESI_JSON_DECODER:
+            decoder = app_settings.ESI_JSON_DECODER
+            _json_decoder_func = decoder if callable(decoder) else import_string(decoder)
+        else:
+            for module in ('orjson', 'ujson'):
+                try:
+                    _json_decoder_func = __import__(module).loads
+                    break
+                except ImportError:
+                    continue
+            else:
+                _json_decoder_func = lambda raw: json.loads(raw.decode('utf-8'))
+    return _json_decoder_func
+
+
+class BufferedResponse(IncomingResponse):
+    """
+    Response whose body has been read in full. Responses rebuilt from the cache have no body.
+    """
+    def __init__(self, status_code, reason, headers, raw_bytes=None):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = CaseInsensitiveDict(headers)
+        self.raw_bytes = raw_bytes
+
+    @property
+    def text(self):
+        return self.raw_bytes.decode('utf-8') if self.raw_bytes is not None else None
+
+    def json(self, **kwargs):
+        return json.loads(self.text, **kwargs)
+
+
 class CachingHttpFuture(HttpFuture):
     """
-    Used to add caching to certain HTTP requests according to "Expires" header
+    Used to add caching to certain HTTP requests according to "Expires" header.
+    Responses carrying an "ETag" header are kept past expiry and revalidated with "If-None-Match".
+    Only the result and a few headers are cached, the response returned on a hit carries no body.
     """
     def __init__(self, *args, **kwargs):
         super(CachingHttpFuture, self).__init__(*args, **kwargs)
-        self.cache_key = self._build_cache_key(self.future.request)
+        # set by the http client, identifies whose private data a response holds
+        self.token = None
+        # set by EsiCallableOperation so the response can be refreshed in the background
+        self.esi_call = None
+        self._cache_key = None
+        # return decoded JSON as is, without validating or unmarshalling it against the spec
+        self.raw = False
+        # reported by the esi_request signal
+        self.cache_status = None
+        self.response_size = 0
+        self.retries = 0
+        # seconds spent in each phase of TIMING_PHASES, only recorded for a sample of requests
+        sample_rate = app_settings.ESI_TIMING_SAMPLE_RATE
+        self.timings = {} if sample_rate and random.random() < sample_rate else None
+
+    @contextmanager
+    def _timed(self, phase):
+        if self.timings is None:
+            yield
+            return
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.timings[phase] = self.timings.get(phase, 0) + time.time() - started
+
+    @property
+    def cache_key(self):
+        if self._cache_key is None:
+            self._cache_key = self._build_cache_key(self.future.request, operation=self.operation, token=self.token,
+                                                    raw=self.raw)
+        return self._cache_key
 
     @staticmethod
-    def _build_cache_key(request):
+    def _requires_authentication(operation):
         """
-        Generated the key name used to cache responses
+        Determines if an operation has security requirements in the spec, meaning its responses are private
+        :param operation: :class:`bravado_core.operation.Operation`
+        """
+        return bool(operation.op_spec.get('security', operation.swagger_spec.spec_dict.get('security')))
+
+    @staticmethod
+    def _build_cache_key(request, operation=None, token=None, raw=False):
+        """
+        Generated the key name used to cache responses.
+        Responses of public operations are shared between all callers, while responses of operations with
+        security requirements are only shared by tokens of the same character.
         :param request: request used to retrieve API response
+        :param operation: :class:`bravado_core.operation.Operation` the request is for
+        :param token: :class:`esi.models.Token` the request is authenticated with
+        :param raw: if the result is cached as decoded JSON rather than unmarshalled
         :return: formatted cache name
         """
-        str_hash = md5(
-            (request.method + request.url + str(request.params) + str(request.data) + str(request.json)).encode(
-                'utf-8')).hexdigest()
-        return 'esi_%s' % str_hash
+        owner = None
+        if operation is None or CachingHttpFuture._requires_authentication(operation):
+            if token is not None:
+                owner = 'character_%s' % token.character_id
+            elif request.headers.get('Authorization'):
+                owner = md5(str(request.headers['Authorization']).encode('utf-8')).hexdigest()
+        key = json.dumps([
+            operation.operation_id if operation is not None else None,
+            request.method,
+            request.url,
+            sorted((str(k), str(v)) for k, v in (request.params or {}).items()),
+            str(request.data),
+            str(request.json),
+            owner,
+        ] + (['raw'] if raw else []))
+        return 'esi_%s' % md5(key.encode('utf-8')).hexdigest()
 
     @staticmethod
     def _time_to_expiry(expires):
         """
         Determines the seconds until a HTTP header "Expires" timestamp
         :param expires: HTTP response "Expires" header
-        :return: seconds until "Expires" time
+        :return: seconds until "Expires" time, or 0 if passed
         """
         try:
             expires_dt = datetime.strptime(str(expires), '%a, %d %b %Y %H:%M:%S %Z')
             delta = expires_dt - datetime.utcnow()
-            return delta.seconds
+            return max(int(delta.total_seconds()), 0)
         except ValueError:
             return 0
 
-    def result(self, **kwargs):
-        if app_settings.ESI_CACHE_RESPONSE and self.future.request.method == 'GET' and self.operation is not None:
-            """
-            Only cache if all are true:
-             - settings dictate caching
-             - it's a http get request
-             - it's to a swagger api endpoint
-            """
-            cached = cache.get(self.cache_key)
-            if cached:
-                result, response = cached
+    def _is_cacheable(self):
+        """
+        Only cache if all are true:
+         - settings dictate caching
+         - it's a http get request
+         - it's to a swagger api endpoint
+        """
+        return app_settings.ESI_CACHE_RESPONSE and self.future.request.method == 'GET' and self.operation is not None
+
+    @staticmethod
+    def _entry_is_fresh(entry):
+        """
+        Determines if a cache entry can be used without revalidation
+        :param entry: cached tuple of (expiry timestamp, status code, reason, headers, payload, compressed)
+        """
+        return entry[0] > time.time()
+
+    def _add_validator(self, entry):
+        """
+        Asks the server to reply "304 Not Modified" if the cached response is still current
+        :param entry: cache entry for this request, if any
+        """
+        etag = entry[3].get('ETag') if entry else None
+        if etag:
+            self.future.request.headers['If-None-Match'] = etag
+        else:
+            self.future.request.headers.pop('If-None-Match', None)
+
+    def _build_entry(self, result, response):
+        """
+        Compacts a response for caching. Only the pickled result and the headers callers may need are kept,
+        not the body or the response object. Results over ESI_CACHE_COMPRESS_THRESHOLD bytes are compressed.
+        :param result: unmarshalled swagger result
+        :param response: :class:`bravado_core.response.IncomingResponse`
+        :return: cache entry tuple of (expiry timestamp, status code, reason, headers, payload, compressed)
+        """
+        headers = {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers}
+        with self._timed('cache_store'):
+            payload = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+            compressed = 0 < app_settings.ESI_CACHE_COMPRESS_THRESHOLD <= len(payload)
+            if compressed:
+                payload = zlib.compress(payload, 1)
+        expires_at = time.time() + self._time_to_expiry(headers.get('Expires'))
+        return expires_at, response.status_code, response.reason, headers, payload, compressed
+
+    def _renew_entry(self, entry, not_modified):
+        """
+        Renews a cache entry using the headers of a "304 Not Modified" response
+        :param entry: cache entry which was revalidated
+        :param not_modified: the 304 response
+        :return: renewed cache entry
+        """
+        _, status_code, reason, headers, payload, compressed = entry
+        headers = dict(headers)
+        for name in ('Expires', 'ETag', 'Last-Modified'):
+            if name in not_modified.headers:
+                headers[name] = not_modified.headers[name]
+        expires_at = time.time() + self._time_to_expiry(headers.get('Expires'))
+        return expires_at, status_code, reason, headers, payload, compressed
+
+    def _load_entry(self, entry):
+        """
+        Rebuilds the result and a lightweight response, carrying only the cached headers, from a cache entry
+        :return: tuple of result and :class:`esi.clients.BufferedResponse`
+        """
+        _, status_code, reason, headers, payload, compressed = entry
+        with self._timed('cache_load'):
+            if compressed:
+                payload = zlib.decompress(payload)
+            return pickle.loads(payload), BufferedResponse(status_code, reason, headers)
+
+    @staticmethod
+    def _entry_timeout(entry):
+        """
+        Determines how long to keep a cache entry
+        :return: seconds, or 0 if it shouldn't be cached
+        """
+        expires = entry[0] - time.time()
+        if expires <= 0:
+            return 0
+        extra = app_settings.ESI_CACHE_STALE_DURATION
+        if 'ETag' in entry[3]:
+            extra = max(extra, app_settings.ESI_CACHE_ETAG_DURATION)
+        return int(math.ceil(expires)) + extra
+
+    @staticmethod
+    def _can_serve_stale(entry):
+        """
+        Determines if a stale cache entry is recent enough to serve while it is refreshed in the background
+        """
+        return entry[0] + app_settings.ESI_CACHE_STALE_DURATION > time.time()
+
+    def _queue_refresh(self):
+        """
+        Queues a task to refresh this cache entry, unless one is queued already
+        :return: True if a refresh is queued
+        """
+        if not self.esi_call:
+            return False
+        if not cache.add(self.cache_key + '_refresh', True, app_settings.ESI_CACHE_STALE_DURATION):
+            return True
+        from esi.tasks import refresh_cached_response
+        try:
+            refresh_cached_response.delay(**self.esi_call)
+        except Exception:
+            logger.exception("Failed to queue refresh of {0}".format(self.cache_key))
+            cache.delete(self.cache_key + '_refresh')
+            return False
+        return True
+
+    def refresh(self, **kwargs):
+        """
+        Retrieves the response again and caches it, regardless of the current cache entry
+        :return: tuple of result and response
+        """
+        try:
+            return self._fetch_and_store(response_cache.get(self.cache_key), **kwargs)
+        finally:
+            cache.delete(self.cache_key + '_refresh')
+
+    def _lookup_entry(self):
+        with self._timed('cache_lookup'):
+            return response_cache.get(self.cache_key)
+
+    def _store(self, entry):
+        timeout = self._entry_timeout(entry)
+        if timeout:
+            with self._timed('cache_store'):
+                response_cache.set(self.cache_key, entry, timeout)
+
+    def _open_stream(self, timeout=None):
+        """
+        Sends the request without reading the response body
+        :return: :class:`requests.Response`
+        """
+        adapter = self.future
+        request = adapter.request
+        request.headers = {k: str(v) if not isinstance(v, bytes) else v for k, v in request.headers.items()}
+        return adapter.session.send(adapter.session.prepare_request(request), stream=True,
+                                    timeout=adapter.build_timeout(timeout))
+
+    @reraise_errors
+    def _send(self, timeout=None, stream=False):
+        """
+        Sends the request once the error limit allows it, retrying transient failures
+        :param stream: Leave the response body unread, to be read with `iter_content`
+        :return: :class:`bravado_core.response.IncomingResponse`
+        """
+        retries = RetryTracker(self.future.request.method)
+        while True:
+            with self._timed('wait'):
+                throttle.wait_for_error_limit()
+            try:
+                started = time.time()
+                response = self._open_stream(timeout=timeout) if stream else self.future.result(timeout=timeout)
+                self._record_network_timings(started, response.elapsed.total_seconds())
+                incoming_response = self.response_adapter(response)
+            except requests.exceptions.ConnectionError:
+                delay = retries.backoff()
+                if delay is None:
+                    self.retries = retries.attempts
+                    raise
             else:
-                _also_return_response = self.also_return_response  # preserve original value
-                self.also_return_response = True  # override to always get the raw response for expiry header
-                result, response = super(CachingHttpFuture, self).result(**kwargs)
-                self.also_return_response = _also_return_response  # restore original value
-
-                if 'Expires' in response.headers:
-                    expires = self._time_to_expiry(response.headers['Expires'])
-                    if expires > 0:
-                        cache.set(self.cache_key, (result, response), expires)
-
-            if self.also_return_response:
-                return result, response
+                throttle.record_error_limit(incoming_response)
+                delay = retries.backoff(incoming_response)
+                if delay is None:
+                    if stream:
+                        self.retries = retries.attempts
+                    else:
+                        self._record_response(incoming_response, retries.attempts)
+                    return incoming_response
+                if stream:
+                    response.close()
+            with self._timed('wait'):
+                time.sleep(delay)
+
+    def _record_network_timings(self, started, ttfb):
+        """
+        Splits the time taken to receive a response into waiting for its headers and downloading its body
+        :param started: timestamp the request was sent
+        :param ttfb: seconds until the response headers were received
+        """
+        if self.timings is not None:
+            self.timings['ttfb'] = self.timings.get('ttfb', 0) + ttfb
+            self.timings['download'] = self.timings.get('download', 0) + max(time.time() - started - ttfb, 0)
+
+    def _unmarshal(self, incoming_response):
+        """
+        Validates and unmarshals a response, raising for error status codes
+        :return: swagger result
+        """
+        with self._timed('unmarshal'):
+            if self.raw:
+                self._decode_raw(incoming_response)
             else:
-                return result
+                unmarshal_response(incoming_response, self.operation, self.response_callbacks)
+        return incoming_response.swagger_result
+
+    def _decode_raw(self, incoming_response):
+        """
+        Decodes a response body with the ESI_JSON_DECODER, raising for error status codes as `unmarshal_response` does
+        """
+        try:
+            raise_on_unexpected(incoming_response)
+            try:
+                result = get_json_decoder()(incoming_response.raw_bytes) if incoming_response.raw_bytes else None
+            except ValueError:
+                if 200 <= incoming_response.status_code < 300:
+                    raise
+                # error bodies aren't always JSON
+                result = None
+            incoming_response.swagger_result = result
+        finally:
+            for response_callback in self.response_callbacks or []:
+                response_callback(incoming_response, self.operation)
+        raise_on_expected(incoming_response)
+
+    @property
+    def lock_key(self):
+        return self.cache_key + '_lock'
+
+    def _acquire_fetch_lock(self):
+        """
+        Attempts to become the only process retrieving this response, so that an expiring
+        entry doesn't send every worker to ESI at once.
+        :return: True if this future should retrieve the response
+        """
+        self._lock_token = None
+        if not app_settings.ESI_CACHE_SINGLE_FLIGHT:
+            return True
+        token = uuid4().hex
+        try:
+            if not cache.add(self.lock_key, token, app_settings.ESI_CACHE_LOCK_TIMEOUT):
+                return False
+        except NotImplementedError:
+            # backend can't lock, fetch regardless
+            return True
+        # backends without an atomic add may accept several callers: only the last to write holds the lock.
+        # Backends which don't store anything can't lock either, so fetch regardless.
+        holder = cache.get(self.lock_key)
+        if holder == token:
+            self._lock_token = token
+        return holder in (token, None)
+
+    def _release_fetch_lock(self):
+        if self._lock_token and cache.get(self.lock_key) == self._lock_token:
+            cache.delete(self.lock_key)
+        self._lock_token = None
+
+    def _poll_fetched_entry(self):
+        """
+        Checks if the process holding the fetch lock is done
+        :return: tuple of (done, fresh cache entry if available)
+        """
+        entry = response_cache.get(self.cache_key)
+        if entry and self._entry_is_fresh(entry):
+            return True, entry
+        return cache.get(self.lock_key) is None, None
+
+    def _wait_for_fetch(self):
+        """
+        Waits for the process holding the fetch lock to cache the response
+        :return: fresh cache entry, or None if it wasn't cached in time
+        """
+        deadline = time.time() + app_settings.ESI_CACHE_LOCK_TIMEOUT
+        while time.time() < deadline:
+            time.sleep(app_settings.ESI_CACHE_LOCK_POLL_INTERVAL)
+            done, entry = self._poll_fetched_entry()
+            if done:
+                return entry
+        return None
+
+    def _fetch_and_store(self, entry, **kwargs):
+        """
+        Retrieves the response, revalidating the cache entry if possible, and caches it
+        :param entry: stale cache entry for this request, if any
+        :return: tuple of result and response
+        """
+        self._add_validator(entry)
+        incoming_response = self._send(**kwargs)
+        if entry and incoming_response.status_code == 304:
+            self._record_cache_status('revalidated')
+            entry = self._renew_entry(entry, incoming_response)
+            result, response = self._load_entry(entry)
+        else:
+            self._record_cache_status('miss')
+            result, response = self._unmarshal(incoming_response), incoming_response
+            entry = self._build_entry(result, incoming_response)
+        self._store(entry)
+        return result, response
+
+    def _cached_result(self, **kwargs):
+        entry = self._lookup_entry()
+        if entry and self._entry_is_fresh(entry):
+            self._record_cache_status('hit')
+            return self._load_entry(entry)
+
+        if entry and self._can_serve_stale(entry) and self._queue_refresh():
+            self._record_cache_status('stale')
+            return self._load_entry(entry)
+
+        if not self._acquire_fetch_lock():
+            if entry and self._can_serve_stale(entry):
+                # serve the stale entry while another process revalidates it
+                self._record_cache_status('stale')
+                return self._load_entry(entry)
+            with self._timed('cache_wait'):
+                fetched = self._wait_for_fetch()
+            if fetched:
+                self._record_cache_status('hit')
+                return self._load_entry(fetched)
+        try:
+            return self._fetch_and_store(entry, **kwargs)
+        finally:
+            self._release_fetch_lock()
+
+    def _fetch(self, **kwargs):
+        incoming_response = self._send(**kwargs)
+        return self._unmarshal(incoming_response), incoming_response
+
+    def _record_cache_status(self, status):
+        self.cache_status = status
+        cache_stats.incr(status)
+
+    def _record_response(self, incoming_response, retries):
+        self.response_size = len(incoming_response.raw_bytes or b'')
+        self.retries = retries
+
+    def _log_slow_call(self, latency, status_code):
+        if self.timings:
+            breakdown = ', '.join('{0}={1:.3f}s'.format(phase, self.timings[phase])
+                                  for phase in TIMING_PHASES if phase in self.timings)
         else:
+            breakdown = 'not sampled'
+        logger.warning("Slow ESI call {0} took {1:.3f}s with status {2}, cache {3}, {4} retries ({5}).".format(
+            self.operation.operation_id, latency, status_code, self.cache_status, self.retries, breakdown))
+
+    def _request_finished(self, started, status_code):
+        """
+        Reports the result to receivers of :data:`esi.signals.esi_request`, without letting them raise,
+        and logs it if slower than ESI_SLOW_CALL_THRESHOLD
+        :param started: timestamp the result was requested
+        :param status_code: status of the response, or None if none was received
+        """
+        latency = time.time() - started
+        if self.timings is not None:
+            self.timings['total'] = latency
+        if app_settings.ESI_SLOW_CALL_THRESHOLD and latency >= app_settings.ESI_SLOW_CALL_THRESHOLD:
+            self._log_slow_call(latency, status_code)
+        responses = signals.esi_request.send_robust(
+            sender=self.__class__, future=self, operation_id=self.operation.operation_id,
+            method=self.future.request.method, status_code=status_code, cache=self.cache_status,
+            latency=latency, size=self.response_size, retries=self.retries)
+        for receiver, response in responses:
+            if isinstance(response, Exception):
+                logger.error("esi_request receiver {0} failed: {1!r}".format(receiver, response))
+
+    def result(self, **kwargs):
+        if self.operation is None:
+            # not an API call, such as retrieving the spec
             return super(CachingHttpFuture, self).result(**kwargs)
 
+        started = time.time()
+        try:
+            if self._is_cacheable():
+                result, response = self._cached_result(**kwargs)
+            else:
+                result, response = self._fetch(**kwargs)
+        except Exception as e:
+            self._request_finished(started, getattr(e, 'status_code', None))
+            raise
+        self._request_finished(started, response.status_code)
+        response.timings = self.timings
+        if self.also_return_response:
+            return result, response
+        else:
+            return result
+
+    def _page_future(self, page):
+        """
+        Creates a future for another page of this operation, sharing the session and request options
+        :param page: page number to request
+        :return: :class:`esi.clients.CachingHttpFuture`
+        """
+        future = requests_client.RequestsFutureAdapter(
+            self.future.session, copy_request_for_page(self.future.request, page), self.future.misc_options)
+        page_future = self.__class__(future, self.response_adapter, operation=self.operation,
+                                     response_callbacks=self.response_callbacks, also_return_response=True)
+        page_future.token = self.token
+        page_future.raw = self.raw
+        return page_future
+
+    def result_all_pages(self, merge=True, max_workers=None, **kwargs):
+        """
+        Retrieves every page of a paginated operation. The first page is retrieved to read the number
+        of pages from the "X-Pages" header, then the remaining pages are retrieved concurrently.
+        Each page is cached individually. Call the operation without a page argument.
+        :param merge: Return a single list of all items if True, otherwise an iterator over the result of each page.
+        :param max_workers: Maximum number of pages retrieved at once. Defaults to ESI_PAGE_MAX_WORKERS.
+        :return: list of items, or iterator of page results in page order
+        """
+        _also_return_response = self.also_return_response
+        self.also_return_response = True
+        try:
+            first, response = self.result(**kwargs)
+        finally:
+            self.also_return_response = _also_return_response
+        pages = get_page_count(response)
+
+        def fetch(page):
+            return self._page_future(page).result(**kwargs)[0]
+
+        def iterate():
+            yield first
+            if pages > 1:
+                pool = ThreadPool(min(max_workers or app_settings.ESI_PAGE_MAX_WORKERS, pages - 1))
+                try:
+                    for result in pool.imap(fetch, range(2, pages + 1)):
+                        yield result
+                finally:
+                    pool.terminate()
+
+        if merge:
+            return list(chain.from_iterable(iterate()))
+        return iterate()
+
+    def _build_item_unmarshaller(self, status_code):
+        """
+        Creates a function validating and unmarshalling a single item of an array response
+        :param status_code: status of the response
+        :return: callable taking a decoded item and returning its unmarshalled value
+        """
+        swagger_spec = self.operation.swagger_spec
+        response_spec = get_response_spec(status_code, self.operation)
+        schema = swagger_spec.deref(response_spec.get('schema', {}))
+        if schema.get('type') != 'array':
+            raise ValueError('{0} does not respond with an array'.format(self.operation.operation_id))
+        if self.raw:
+            return lambda item: item
+        item_spec = swagger_spec.deref(schema['items'])
+        validate = swagger_spec.config.get('validate_responses', False)
+
+        def unmarshal(item):
+            if validate:
+                validate_schema_object(swagger_spec, item_spec, item)
+            return unmarshal_schema_object(swagger_spec, item_spec, item)
+        return unmarshal
+
+    def _stream_items(self, chunk_size, timeout=None):
+        """
+        Sends the request and unmarshals the items of the array response as they are received
+        :return: tuple of the :class:`requests.Response` and a generator of items
+        """
+        started = time.time()
+        response = None
+        status_code = None
+        try:
+            incoming_response = self._send(timeout=timeout, stream=True)
+            response = incoming_response._delegate
+            status_code = incoming_response.status_code
+            if not 200 <= status_code < 300:
+                # reads the body to raise the appropriate error
+                self._unmarshal(incoming_response)
+            unmarshal = self._build_item_unmarshaller(status_code)
+        except Exception as e:
+            if response is not None:
+                response.close()
+            self._request_finished(started, getattr(e, 'status_code', status_code))
+            raise
+
+        def read_chunks():
+            for chunk in response.iter_content(chunk_size):
+                self.response_size += len(chunk)
+                yield chunk
+
+        def iterate():
+            try:
+                for item in iter_json_array(read_chunks()):
+                    yield unmarshal(item)
+            finally:
+                response.close()
+                self._request_finished(started, status_code)
+        return response, iterate()
+
+    def stream_result(self, chunk_size=None, **kwargs):
+        """
+        Yields the items of an operation responding with an array as they are received, rather than reading
+        and unmarshalling the whole response first. Each item is validated and unmarshalled as with `result()`.
+        The response is neither read from nor written to the cache.
+        :param chunk_size: Bytes to read from the response at a time. Defaults to ESI_STREAM_CHUNK_SIZE.
+        :return: generator of items
+        """
+        _, items = self._stream_items(chunk_size or app_settings.ESI_STREAM_CHUNK_SIZE, **kwargs)
+        return items
+
+    def stream_all_pages(self, chunk_size=None, **kwargs):
+        """
+        Yields the items of every page of a paginated operation as they are received, as with `stream_result()`.
+        Pages are retrieved one after another. Call the operation without a page argument.
+        :param chunk_size: Bytes to read from the response at a time. Defaults to ESI_STREAM_CHUNK_SIZE.
+        :return: generator of items
+        """
+        chunk_size = chunk_size or app_settings.ESI_STREAM_CHUNK_SIZE
+        response, items = self._stream_items(chunk_size, **kwargs)
+        for item in items:
+            yield item
+        for page in range(2, get_page_count(response) + 1):
+            for item in self._page_future(page).stream_result(chunk_size=chunk_size, **kwargs):
+                yield item
+
 
 requests_client.HttpFuture = CachingHttpFuture
 
 
+def copy_request_for_page(request, page):
+    """
+    Copies a request, changing only the page requested
+    :param request: :class:`requests.Request` to copy
+    :param page: page number to request
+    :return: :class:`requests.Request`
+    """
+    return requests.Request(method=request.method, url=request.url, headers=dict(request.headers),
+                            files=request.files, data=request.data, json=request.json,
+                            params=dict(request.params, page=page), auth=request.auth, cookies=request.cookies,
+                            hooks=request.hooks)
+
+
+def get_page_count(response):
+    """
+    Reads the number of pages available from a response
+    :param response: :class:`bravado_core.response.IncomingResponse`
+    :return: number of pages, 1 if not paginated
+    """
+    try:
+        return max(int(response.headers.get('X-Pages', 1)), 1)
+    except ValueError:
+        return 1
+
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Retrieves the process-wide session used for all ESI requests, creating it if needed.
+    Connections to each host are kept alive and pooled between requests. A new session
+    is created after forking so worker processes never share sockets with their parent.
+    :return: :class:`requests.Session`
+    """
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=app_settings.ESI_CONNECTION_POOL_SIZE,
+                                  pool_maxsize=app_settings.ESI_CONNECTION_POOL_MAXSIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            # the session is shared between tokens so must not carry state between their requests
+            session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+            _session = session
+            _session_pid = os.getpid()
+        return _session
+
+
+class EsiRequestsClient(requests_client.RequestsClient):
+    """
+    RequestsClient which sends all requests through the process-wide pooled session.
+    Authentication is applied to each request, so any number of clients can share connections.
+    """
+    def __init__(self, authenticator=None, client_kwargs=None, raw=False):
+        self.authenticator = authenticator
+        # arguments to esi_client_factory which created this client, excluding the token
+        self.client_kwargs = client_kwargs
+        # default for the raw request option of operations called through this client
+        self.raw = raw
+
+    @property
+    def session(self):
+        return get_session()
+
+    def request(self, request_params, operation=None, response_callbacks=None, also_return_response=False):
+        if operation is not None:
+            request_params = with_datasource(request_params)
+        # authentication, including any token refresh, is applied while building the future
+        started = time.time()
+        future = super(EsiRequestsClient, self).request(request_params, operation=operation,
+                                                        response_callbacks=response_callbacks,
+                                                        also_return_response=also_return_response)
+        if future.timings is not None:
+            future.timings['auth'] = time.time() - started
+        future.token = getattr(self.authenticator, 'token', None)
+        future.raw = self.raw
+        return future
+
+
+def with_datasource(request_params):
+    """
+    Sends requests without a datasource to ESI_API_DATASOURCE rather than the default of ESI, so the response
+    is the one its cache key is for
+    :param request_params: dict of request parameters for an operation
+    :return: copy of request_params
+    """
+    params = dict(request_params.get('params') or {})
+    params.setdefault('datasource', app_settings.ESI_API_DATASOURCE)
+    return dict(request_params, params=params)
+
+
 class TokenAuthenticator(requests_client.Authenticator):
     """
     Adds the authorization header containing access token, if specified.
@@ -99,10 +897,15 @@ class TokenAuthenticator(requests_client.Authenticator):
         self.token = token
         self.datasource = datasource
 
+    def _refresh_token(self):
+        started = time.time()
+        self.token.refresh()
+        signals.token_refreshed.send_robust(sender=self.__class__, token=self.token, latency=time.time() - started)
+
     def apply(self, request):
         if self.token and self.token.expired:
             if self.token.can_refresh:
-                self.token.refresh()
+                self._refresh_token()
             else:
                 raise TokenExpiredError()
         request.headers['Authorization'] = 'Bearer ' + self.token.access_token if self.token else None
@@ -127,7 +930,7 @@ def cache_spec(name, spec):
     :param spec: Spec dict
     :return: True if cached
     """
-    return cache.set(build_cache_name(name), spec, app_settings.ESI_SPEC_CACHE_DURATION)
+    return spec_cache.set(build_cache_name(name), spec, app_settings.ESI_SPEC_CACHE_DURATION)
 
 
 def build_spec_url(spec_version):
@@ -139,6 +942,71 @@ def build_spec_url(spec_version):
     return urlparse.urljoin(app_settings.ESI_API_URL, spec_version + '/swagger.json')
 
 
+_spec_bundles = {}
+_spec_bundles_lock = threading.Lock()
+
+
+def load_spec_bundle(path):
+    """
+    Reads a spec bundle written by the esi_spec_bundle management command.
+    Each bundle is only read again once its file changes.
+    :param path: String path to the spec bundle file
+    :return: dict of spec dicts, by version name
+    """
+    modified = os.path.getmtime(path)
+    with _spec_bundles_lock:
+        bundle = _spec_bundles.get(path)
+        if bundle is None or bundle[0] != modified:
+            with open(path, 'r') as f:
+                bundle = (modified, json.loads(f.read())['specs'])
+            _spec_bundles[path] = bundle
+    return bundle[1]
+
+
+def write_spec_bundle(path, specs):
+    """
+    Writes spec dicts to a spec bundle file, replacing any existing bundle at once
+    :param path: String path to the spec bundle file
+    :param specs: dict of spec dicts, by version name
+    """
+    temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(temp_path, 'w') as f:
+        f.write(json.dumps({'created': int(time.time()), 'specs': specs}))
+    os.rename(temp_path, path)
+
+
+def fetch_spec_dict(name, http_client=None):
+    """
+    Retrieves a spec dict from ESI
+    :param name: Name of the revision of spec, eg latest or v4
+    :param http_client: Requests client used for retrieving specs
+    :return: spec dict
+    """
+    loader = Loader(http_client or EsiRequestsClient())
+    return loader.load_spec(build_spec_url(name))
+
+
+def get_spec_dict(name, http_client=None):
+    """
+    Retrieves a spec dict from the ESI_SPEC_BUNDLE file if it can be read and contains the version,
+    otherwise from the cache or ESI.
+    :param name: Name of the revision of spec, eg latest or v4
+    :param http_client: Requests client used for retrieving specs
+    :return: spec dict
+    """
+    if app_settings.ESI_SPEC_BUNDLE:
+        try:
+            return load_spec_bundle(app_settings.ESI_SPEC_BUNDLE)[name]
+        except KeyError:
+            logger.warning("Spec bundle {0} does not contain {1}, retrieving it from ESI.".format(
+                app_settings.ESI_SPEC_BUNDLE, name))
+        except (IOError, OSError, ValueError) as e:
+            logger.warning("Unable to read spec bundle {0}, retrieving {1} from ESI: {2}".format(
+                app_settings.ESI_SPEC_BUNDLE, name, e))
+    return spec_cache.get_or_set(build_cache_name(name), lambda: fetch_spec_dict(name, http_client=http_client),
+                                 app_settings.ESI_SPEC_CACHE_DURATION)
+
+
 def get_spec(name, http_client=None, config=None):
     """
     :param name: Name of the revision of spec, eg latest or v4
@@ -146,13 +1014,8 @@ def get_spec(name, http_client=None, config=None):
     :param config: Spec configuration - see Spec.CONFIG_DEFAULTS
     :return: :class:`bravado_core.spec.Spec`
     """
-    http_client = http_client or requests_client.RequestsClient()
-
-    def load_spec():
-        loader = Loader(http_client)
-        return loader.load_spec(build_spec_url(name))
-
-    spec_dict = cache.get_or_set(build_cache_name(name), load_spec, app_settings.ESI_SPEC_CACHE_DURATION)
+    http_client = http_client or EsiRequestsClient()
+    spec_dict = get_spec_dict(name, http_client=http_client)
     config = dict(CONFIG_DEFAULTS, **(config or {}))
     return Spec.from_dict(spec_dict, build_spec_url(name), http_client, config)
 
@@ -178,44 +1041,351 @@ def build_spec(base_version, http_client=None, **kwargs):
     return base_spec
 
 
+def load_spec_file(path, http_client=None):
+    """
+    Reads in a local swagger spec file and builds a Spec from it
+    :param path: String path to local swagger spec file.
+    :param http_client: :class:`bravado.requests_client.RequestsClient`
+    :return: :class:`bravado_core.spec.Spec`
+    """
+    with open(path, 'r') as f:
+        spec_dict = json.loads(f.read())
+
+    config = dict(CONFIG_DEFAULTS, **SPEC_CONFIG)
+    return Spec.from_dict(spec_dict, http_client=http_client or EsiRequestsClient(), config=config)
+
+
 def read_spec(path, http_client=None):
     """
     Reads in a swagger spec file used to initialize a SwaggerClient
     :param path: String path to local swagger spec file.
     :param http_client: :class:`bravado.requests_client.RequestsClient`
-    :return: :class:`bravado_core.spec.Spec`
+    :return: :class:`bravado.client.SwaggerClient`
+    """
+    return SwaggerClient(load_spec_file(path, http_client=http_client))
+
+
+class _LazyOperations(object):
+    """
+    Mapping of operation IDs to operations, building each on first access
+    """
+    def __init__(self, lazy_spec, operation_ids):
+        self.lazy_spec = lazy_spec
+        self.operation_ids = operation_ids
+
+    def __contains__(self, operation_id):
+        return operation_id in self.operation_ids
+
+    def __iter__(self):
+        return iter(self.operation_ids)
+
+    def __len__(self):
+        return len(self.operation_ids)
+
+    def keys(self):
+        return list(self.operation_ids)
+
+    def get(self, operation_id, default=None):
+        if operation_id not in self.operation_ids:
+            return default
+        return self.lazy_spec.get_operation(operation_id)
+
+    def __getitem__(self, operation_id):
+        if operation_id not in self.operation_ids:
+            raise KeyError(operation_id)
+        return self.lazy_spec.get_operation(operation_id)
+
+
+class LazySpec(object):
+    """
+    Stands in for a :class:`bravado_core.spec.Spec`, only building an operation when it is first accessed.
+    Each operation is built from a spec dict minimized to that operation, so building it doesn't
+    validate or build the rest of the spec. Operations are built once and shared by all clients using this spec.
+    """
+    def __init__(self, spec_dict, origin_url='', http_client=None, config=None, resource_specs=None):
+        """
+        :param spec_dict: Spec dict of the base version
+        :param origin_url: URL the spec dict was retrieved from
+        :param http_client: :class:`bravado.requests_client.RequestsClient`
+        :param config: Spec configuration - see Spec.CONFIG_DEFAULTS
+        :param resource_specs: Resources to take from other versions, as {name: (spec_dict, origin_url)}
+        """
+        self.spec_dict = spec_dict
+        self.origin_url = origin_url
+        self.api_url = build_api_serving_url(spec_dict, origin_url)
+        self.http_client = http_client
+        self.config = dict(CONFIG_DEFAULTS, **(config or {}))
+        self._operations = {}
+        self._lock = threading.Lock()
+
+        resources = self._index(spec_dict, origin_url)
+        for name, (resource_spec_dict, resource_origin_url) in (resource_specs or {}).items():
+            try:
+                resources[name] = self._index(resource_spec_dict, resource_origin_url)[name]
+            except KeyError:
+                raise AttributeError('Resource {0} not found on API revision {1}'.format(name, resource_origin_url))
+        self._sources = {}  # operation ID: (spec dict, origin url)
+        for sources in resources.values():
+            self._sources.update(sources)
+        self.resources = {name: Resource(name, _LazyOperations(self, set(sources)))
+                          for name, sources in resources.items()}
+
+    @staticmethod
+    def _index(spec_dict, origin_url):
+        """
+        Finds the operations of each resource in a spec dict, without building anything
+        :return: dict of {resource name: {operation ID: (spec dict, origin url)}}
+        """
+        resources = {}
+        for path in spec_dict['paths'].values():
+            for method, data in path.items():
+                if method.startswith('x-') or method == 'parameters':
+                    continue
+                for tag in data.get('tags', []):
+                    resources.setdefault(sanitize_name(tag), {})[data['operationId']] = (spec_dict, origin_url)
+        return resources
+
+    def get_operation(self, operation_id):
+        """
+        Retrieves an operation, building it if this is its first use
+        :param operation_id: ID of the operation
+        :return: :class:`bravado_core.operation.Operation`
+        """
+        with self._lock:
+            operation = self._operations.get(operation_id)
+            if operation is None:
+                spec_dict, origin_url = self._sources[operation_id]
+                spec = Spec.from_dict(minimize_spec(spec_dict, operations=[operation_id]), origin_url,
+                                      self.http_client, self.config)
+                for resource in spec.resources.values():
+                    operation = resource.operations.get(operation_id)
+                    if operation is not None:
+                        break
+                self._operations[operation_id] = operation
+        return operation
+
+
+def build_lazy_spec(base_version, http_client=None, **kwargs):
+    """
+    Generates a LazySpec, supporting mixed resource versions as with :func:`build_spec`
+    :param base_version: Version to base the spec on. Any resource without an explicit version will be this.
+    :param http_client: :class:`bravado.requests_client.RequestsClient`
+    :param kwargs: Explicit resource versions, by name (eg Character='v4')
+    :return: :class:`esi.clients.LazySpec`
+    """
+    http_client = http_client or EsiRequestsClient()
+    resource_specs = {resource.capitalize(): (get_spec_dict(resource_version, http_client=http_client),
+                                              build_spec_url(resource_version))
+                      for resource, resource_version in kwargs.items()}
+    return LazySpec(get_spec_dict(base_version, http_client=http_client), build_spec_url(base_version),
+                    http_client=http_client, config=SPEC_CONFIG, resource_specs=resource_specs)
+
+
+def load_lazy_spec_file(path, http_client=None):
+    """
+    Reads in a local swagger spec file and builds a LazySpec from it
+    :param path: String path to local swagger spec file.
+    :param http_client: :class:`bravado.requests_client.RequestsClient`
+    :return: :class:`esi.clients.LazySpec`
     """
     with open(path, 'r') as f:
         spec_dict = json.loads(f.read())
+    return LazySpec(spec_dict, http_client=http_client or EsiRequestsClient(), config=SPEC_CONFIG)
 
-    return SwaggerClient.from_spec(spec_dict, http_client=http_client, config=SPEC_CONFIG)
 
+_spec_registry = {}
+_spec_registry_lock = threading.Lock()
+# per-key locks so only one caller builds a given spec, without blocking lookups of the others
+_spec_build_locks = {}
 
-def esi_client_factory(token=None, datasource=None, spec_file=None, version=None, **kwargs):
+
+def _build_spec_registry_key(version, spec_file, resource_versions):
+    """
+    Generates the key identifying a built spec in the process-wide registry
+    :param version: Base ESI API version
+    :param spec_file: Path to a local swagger spec file
+    :param resource_versions: Explicit resource versions, by name
+    :return: hashable key
+    """
+    if spec_file:
+        # versioning is ignored when building from a local spec file
+        return None, spec_file, ()
+    return version, None, tuple(sorted((name.capitalize(), v) for name, v in resource_versions.items()))
+
+
+def _build_registered_spec(key, version, spec_file, **kwargs):
+    """
+    Builds a spec and stores it in the process-wide registry
+    :param key: registry key of the spec
+    :param version: Base ESI API version
+    :param spec_file: Path to a local swagger spec file
+    :param kwargs: Explicit resource versions, by name
+    :return: :class:`bravado_core.spec.Spec`
+    """
+    logger.debug("Building spec for {0}".format(key))
+    if spec_file:
+        spec = load_lazy_spec_file(spec_file) if app_settings.ESI_LAZY_SPEC else load_spec_file(spec_file)
+    elif app_settings.ESI_LAZY_SPEC:
+        spec = build_lazy_spec(version, **kwargs)
+    else:
+        spec = build_spec(version, **kwargs)
+    with _spec_registry_lock:
+        _spec_registry[key] = (spec, time.time() + app_settings.ESI_SPEC_CACHE_DURATION)
+    return spec
+
+
+def get_registered_spec(version=None, spec_file=None, **kwargs):
+    """
+    Retrieves a built Spec from the process-wide registry, building it if absent or
+    older than ESI_SPEC_CACHE_DURATION. Specs are shared between all clients in this process
+    so they must not be modified once built. While an expired spec is being rebuilt
+    other callers continue to receive the expired one.
+    :param version: Base ESI API version. Defaults to ESI_API_VERSION.
+    :param spec_file: Absolute path to a swagger spec file to load.
+    :param kwargs: Explicit resource versions, by name (eg Character='v4')
+    :return: :class:`bravado_core.spec.Spec`
+    """
+    version = version or app_settings.ESI_API_VERSION
+    key = _build_spec_registry_key(version, spec_file, kwargs)
+    with _spec_registry_lock:
+        entry = _spec_registry.get(key)
+        if entry is not None and entry[1] > time.time():
+            return entry[0]
+        build_lock = _spec_build_locks.setdefault(key, threading.Lock())
+
+    if entry is not None:
+        # expired: one caller rebuilds while the rest keep using the old spec
+        if not build_lock.acquire(False):
+            return entry[0]
+    else:
+        build_lock.acquire()
+    try:
+        with _spec_registry_lock:
+            # another caller may have built it while we waited for the lock
+            current = _spec_registry.get(key)
+        if current is not None and current[1] > time.time():
+            return current[0]
+        return _build_registered_spec(key, version, spec_file, **kwargs)
+    finally:
+        build_lock.release()
+
+
+def clear_spec_registry():
+    """
+    Discards all specs built in this process. They will be rebuilt on next use.
+    """
+    with _spec_registry_lock:
+        _spec_registry.clear()
+
+
+def warm_up_specs():
+    """
+    Builds the specs for ESI_API_VERSION and ESI_SPEC_WARM_UP_RESOURCE_VERSIONS in the process-wide registry,
+    so the first clients don't wait for them. Failures are logged rather than raised.
+    """
+    try:
+        get_registered_spec(**app_settings.ESI_SPEC_WARM_UP_RESOURCE_VERSIONS)
+    except Exception:
+        logger.exception("Failed to warm up ESI specs.")
+
+
+class EsiCallableOperation(CallableOperation):
+    """
+    Issues requests through the http client of the :class:`EsiClient` it was accessed from,
+    instead of the http client the shared Spec was built with.
+    """
+    def __init__(self, operation, http_client, resource_name=None, also_return_response=False):
+        super(EsiCallableOperation, self).__init__(operation, also_return_response=also_return_response)
+        self.http_client = http_client
+        self.resource_name = resource_name
+
+    def __call__(self, **op_kwargs):
+        logger.debug('{0}({1})'.format(self.operation.operation_id, op_kwargs))
+        warn_for_deprecated_op(self.operation)
+        request_options = dict(REQUEST_OPTIONS_DEFAULTS, **(op_kwargs.pop('_request_options', {})))
+        request_params = construct_request(self.operation, request_options, **op_kwargs)
+        also_return_response = request_options.get('also_return_response', self.also_return_response)
+        future = self.http_client.request(
+            request_params,
+            operation=self.operation,
+            response_callbacks=request_options['response_callbacks'],
+            also_return_response=also_return_response,
+        )
+        if 'raw' in request_options:
+            future.raw = request_options['raw']
+        client_kwargs = getattr(self.http_client, 'client_kwargs', None)
+        if client_kwargs is not None and self.resource_name:
+            # record how to repeat this call from another process, see esi.tasks.refresh_cached_response
+            token = getattr(self.http_client.authenticator, 'token', None)
+            future.esi_call = {
+                'resource': self.resource_name,
+                'operation': self.operation.operation_id,
+                'op_kwargs': op_kwargs,
+                'token_pk': token.pk if token else None,
+                'client_kwargs': client_kwargs,
+                'raw': future.raw,
+            }
+        return future
+
+
+class EsiResourceDecorator(ResourceDecorator):
+    """
+    Wraps resource operations with :class:`EsiCallableOperation`
+    """
+    def __init__(self, resource, http_client, also_return_response=False):
+        super(EsiResourceDecorator, self).__init__(resource, also_return_response=also_return_response)
+        self.http_client = http_client
+
+    def __getattr__(self, name):
+        return EsiCallableOperation(getattr(self.resource, name), self.http_client, resource_name=self.resource.name,
+                                    also_return_response=self.also_return_response)
+
+
+class EsiClient(SwaggerClient):
+    """
+    SwaggerClient which sends requests through its own http client rather than the one bound to its Spec.
+    This allows a single built Spec to be shared by clients with different authentication.
+    """
+    def __init__(self, swagger_spec, http_client=None, also_return_response=False):
+        self.http_client = http_client or swagger_spec.http_client
+        self._also_return_response = also_return_response
+        super(EsiClient, self).__init__(swagger_spec, also_return_response=also_return_response)
+
+    def _get_resource(self, item):
+        resource = self.swagger_spec.resources.get(item)
+        if not resource:
+            raise AttributeError(
+                'Resource {0} not found. Available resources: {1}'.format(item, ', '.join(dir(self))))
+        return EsiResourceDecorator(resource, self.http_client, self._also_return_response)
+
+
+def esi_client_factory(token=None, datasource=None, spec_file=None, version=None, raw=False, **kwargs):
     """
     Generates an ESI client.
     :param token: :class:`esi.Token` used to access authenticated endpoints.
     :param datasource: Name of the ESI datasource to access.
     :param spec_file: Absolute path to a swagger spec file to load.
     :param version: Base ESI API version. Accepted values are 'legacy', 'latest', 'dev', or 'vX' where X is a number.
+    :param raw: Return results as decoded JSON, skipping validation and unmarshalling. Operations accept
+    `_request_options={'raw': ...}` to override this per call.
     :param kwargs: Explicit resource versions to build, in the form Character='v4'. Same values accepted as version.
-    :return: :class:`bravado.client.SwaggerClient`
+    :return: :class:`esi.clients.EsiClient`
 
     If a spec_file is specified, specific versioning is not available. Meaning the version and resource version kwargs
     are ignored in favour of the versions available in the spec_file.
+
+    Specs are built once per process and reused until ESI_SPEC_CACHE_DURATION elapses. Only the http client
+    carrying the token and datasource is created for each call, and it sends requests over pooled connections
+    shared by all clients.
     """
 
-    client = requests_client.RequestsClient()
+    client = EsiRequestsClient(client_kwargs=dict(datasource=datasource, spec_file=spec_file, version=version,
+                                                  raw=raw, **kwargs), raw=raw)
     if token or datasource:
         client.authenticator = TokenAuthenticator(token=token, datasource=datasource)
 
-    api_version = version or app_settings.ESI_API_VERSION
-
-    if spec_file:
-        return read_spec(spec_file, http_client=client)
-    else:
-        spec = build_spec(api_version, http_client=client, **kwargs)
-        return SwaggerClient(spec)
+    spec = get_registered_spec(version=version, spec_file=spec_file, **kwargs)
+    return EsiClient(spec, http_client=client)
 
 
 def minimize_spec(spec_dict, operations=None, resources=None):
@@ -245,3 +1415,162 @@ def minimize_spec(spec_dict, operations=None, resources=None):
                 minimized['paths'][path_name][method] = data
 
     return minimized
+
+
+# cached for values the operation rejected or did not resolve, so they aren't requested again
+_UNRESOLVED = False
+
+
+class _Lookup(object):
+    """
+    A value awaiting resolution by an :class:`IdBatcher`, shared by every caller requesting it.
+    """
+    def __init__(self):
+        self.event = threading.Event()
+        self.item = None
+        self.error = None
+
+
+class IdBatcher(object):
+    """
+    Resolves values through a bulk operation such as Universe.post_universe_names, combining the lookups of
+    concurrent callers. The first caller waits ESI_ID_BATCH_WINDOW seconds for others to join, then requests
+    every distinct value not already cached in chunks of up to chunk_size. Each value is cached on its own
+    for ESI_ID_BATCH_CACHE_DURATION seconds, including values which could not be resolved.
+    """
+    def __init__(self, operation, param, parse, resource='Universe', chunk_size=1000, client=None):
+        """
+        :param operation: Name of the bulk operation
+        :param param: Name of the operation's parameter taking the list of values
+        :param parse: Callable taking an operation result and yielding (value, item) pairs
+        :param resource: Name of the resource the operation belongs to
+        :param chunk_size: Maximum number of values accepted by the operation in one request
+        :param client: :class:`esi.clients.EsiClient` to use, defaults to an unauthenticated client
+        """
+        self.operation = operation
+        self.param = param
+        self.parse = parse
+        self.resource = resource
+        self.chunk_size = chunk_size
+        self.client = client
+        self._lookups = {}
+        self._queue = []
+        self._lock = threading.Lock()
+
+    def _cache_key(self, value):
+        return 'esi_{0}_{1}'.format(self.operation, md5('{0}'.format(value).encode('utf-8')).hexdigest())
+
+    def _get_client(self):
+        with self._lock:
+            if self.client is None:
+                self.client = esi_client_factory()
+            return self.client
+
+    def _request(self, values):
+        """
+        Requests items for values, splitting the request to find values the operation rejects
+        :return: dict of value: item for each value resolved
+        """
+        operation = getattr(getattr(self._get_client(), self.resource), self.operation)
+        try:
+            return dict(self.parse(operation(**{self.param: values}).result()))
+        except HTTPNotFound:
+            # ESI rejects the whole request if any value is invalid
+            if len(values) == 1:
+                return {}
+            middle = len(values) // 2
+            items = self._request(values[:middle])
+            items.update(self._request(values[middle:]))
+            return items
+
+    def _flush(self):
+        time.sleep(app_settings.ESI_ID_BATCH_WINDOW)
+        with self._lock:
+            values, self._queue = self._queue, []
+        items, error = {}, None
+        try:
+            for start in range(0, len(values), self.chunk_size):
+                items.update(self._request(values[start:start + self.chunk_size]))
+            cache.set_many({self._cache_key(value): items.get(value, _UNRESOLVED) for value in values},
+                           app_settings.ESI_ID_BATCH_CACHE_DURATION)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            with self._lock:
+                for value in values:
+                    lookup = self._lookups.pop(value)
+                    lookup.item = items.get(value)
+                    lookup.error = error
+                    lookup.event.set()
+
+    def resolve(self, values):
+        """
+        Resolves values, waiting for any batch they join to be requested.
+        :param values: iterable of values to resolve
+        :return: dict of value: item for each value resolved, values the operation rejected are omitted
+        :raises: the operation's error if the batch could not be requested
+        """
+        values = set(values)
+        cached = cache.get_many([self._cache_key(value) for value in values])
+        items = {}
+        lookups = {}
+        flush = False
+        with self._lock:
+            for value in values:
+                item = cached.get(self._cache_key(value))
+                if item is _UNRESOLVED:
+                    continue
+                if item is not None:
+                    items[value] = item
+                    continue
+                if value not in self._lookups:
+                    self._lookups[value] = _Lookup()
+                    if not self._queue:
+                        # the first caller of a batch requests it
+                        flush = True
+                    self._queue.append(value)
+                lookups[value] = self._lookups[value]
+        if flush:
+            self._flush()
+        for value, lookup in lookups.items():
+            lookup.event.wait()
+            if lookup.error is not None:
+                raise lookup.error
+            if lookup.item is not None:
+                items[value] = lookup.item
+        return items
+
+
+def _parse_names(result):
+    for item in result:
+        yield item['id'], item
+
+
+def _parse_ids(result):
+    for category, category_items in result.items():
+        for item in category_items or []:
+            yield item['name'], dict(item, category=category)
+
+
+name_batcher = IdBatcher('post_universe_names', 'ids', _parse_names)
+id_batcher = IdBatcher('post_universe_ids', 'names', _parse_ids, chunk_size=500)
+
+
+def resolve_names(ids):
+    """
+    Resolves IDs to names through the shared batcher for Universe.post_universe_names.
+    :param ids: iterable of IDs of any category post_universe_names accepts
+    :return: dict of id: {'id', 'name', 'category'} for each valid ID
+    """
+    return name_batcher.resolve(ids)
+
+
+def resolve_ids(names):
+    """
+    Resolves exact names to IDs through the shared batcher for Universe.post_universe_ids.
+    :param names: iterable of names
+    :return: dict of name: {'id', 'name', 'category'} for each name found, where category is the response
+    key it was found under, such as 'characters'
+    """
+    return id_batcher.resolve(names)
@@ -0,0 +1,49 @@
+from __future__ import unicode_literals
+from django.core.management.base import BaseCommand, CommandError
+from esi.clients import fetch_spec_dict, minimize_spec, write_spec_bundle
+from esi import app_settings
+
+
+class Command(BaseCommand):
+    help = 'Downloads ESI specs into a bundle file, so clients can be built without retrieving specs from ESI.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('versions', nargs='*',
+                            help='Base versions to bundle. Defaults to ESI_API_VERSION.')
+        parser.add_argument('--resource-version', action='append', default=[], metavar='RESOURCE=VERSION',
+                            help='Bundle an explicit resource version, as passed to esi_client_factory. Repeatable.')
+        parser.add_argument('--resources', nargs='+', default=[], metavar='RESOURCE',
+                            help='Only keep these resources of the base versions.')
+        parser.add_argument('--operations', nargs='+', default=[], metavar='OPERATION',
+                            help='Only keep these operations of the base versions.')
+        parser.add_argument('--output', default=app_settings.ESI_SPEC_BUNDLE,
+                            help='Path of the bundle file. Defaults to ESI_SPEC_BUNDLE.')
+
+    def handle(self, *args, **options):
+        if not options['output']:
+            raise CommandError('Specify --output or set ESI_SPEC_BUNDLE.')
+
+        resource_versions = {}
+        for value in options['resource_version']:
+            try:
+                resource, version = value.split('=')
+            except ValueError:
+                raise CommandError('Resource versions must be in the form Resource=version, not {0}'.format(value))
+            resource_versions.setdefault(version, []).append(resource.capitalize())
+
+        versions = options['versions'] or [app_settings.ESI_API_VERSION]
+        minimize = options['resources'] or options['operations']
+        specs = {}
+        for version in versions:
+            spec_dict = fetch_spec_dict(version)
+            if minimize:
+                spec_dict = minimize_spec(spec_dict, operations=options['operations'],
+                                          resources=options['resources'])
+            specs[version] = spec_dict
+        for version, resources in resource_versions.items():
+            if version not in specs:
+                # only the requested resources are used from override versions
+                specs[version] = minimize_spec(fetch_spec_dict(version), resources=resources)
+
+        write_spec_bundle(options['output'], specs)
+        self.stdout.write('Wrote {0} to {1}'.format(', '.join(sorted(specs)), options['output']))
@@ -1,13 +1,20 @@
 from __future__ import unicode_literals
-from django.db import models
+from django.db import models, transaction
 from requests_oauthlib import OAuth2Session
+from requests.adapters import HTTPAdapter
+from multiprocessing.pool import ThreadPool
 from esi import app_settings
 import requests
 from django.utils import timezone
 from datetime import timedelta
-from django.utils.six import string_types
+from django.utils.six import string_types, reraise
 from esi.errors import TokenError, IncompleteResponseError
+from collections import defaultdict
+from hashlib import md5
+import threading
 import logging
+import time
+import sys
 
 logger = logging.getLogger(__name__)
 
@@ -25,38 +32,188 @@ def _process_scopes(scopes):
     return set(str(s) for s in scopes)
 
 
+def scopes_fingerprint(scopes):
+    """
+    Identifies a set of scopes, so tokens with exactly the same scopes share a fingerprint
+    :param scopes: iterable of scope names
+    :return: hex digest
+    """
+    return md5(' '.join(sorted(set(scopes))).encode('utf-8')).hexdigest()
+
+
+# fingerprint of new tokens, which have no scopes until they're added
+NO_SCOPES_FINGERPRINT = scopes_fingerprint([])
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
 class TokenQueryset(models.QuerySet):
+    def _expiring_before(self, moment):
+        """
+        Filters tokens by their indexed expiry time. Tokens saved without one, such as by `bulk_create()`,
+        fall back to their creation time. The creation time isn't indexed, so those tokens are found through
+        the expiry index by its NULL entries and only then compared by creation time.
+        :param moment: datetime the tokens expire by
+        :rtype: :class:`esi.managers.TokenQueryset`
+        """
+        max_age = moment - timedelta(seconds=app_settings.ESI_TOKEN_VALID_DURATION)
+        return self.filter(models.Q(expires_at__lte=moment) | models.Q(expires_at__isnull=True, created__lte=max_age))
+
+    def _valid_at(self, moment):
+        """
+        Filters tokens which have not expired by a moment, the complement of `_expiring_before()`
+        :param moment: datetime the tokens must be valid at
+        :rtype: :class:`esi.managers.TokenQueryset`
+        """
+        max_age = moment - timedelta(seconds=app_settings.ESI_TOKEN_VALID_DURATION)
+        return self.filter(models.Q(expires_at__gt=moment) | models.Q(expires_at__isnull=True, created__gt=max_age))
+
     def get_expired(self):
         """
         Get all tokens which have expired.
         :return: All expired tokens.
         :rtype: :class:`esi.managers.TokenQueryset`
         """
-        max_age = timezone.now() - timedelta(seconds=app_settings.ESI_TOKEN_VALID_DURATION)
-        return self.filter(created__lte=max_age)
+        return self._expiring_before(timezone.now())
 
-    def bulk_refresh(self):
+    def get_expiring(self, seconds):
         """
-        Refreshes all refreshable tokens in the queryset.
-        Deletes any tokens which fail to refresh.
-        Deletes any tokens which are expired and cannot refresh.
-        Excludes tokens for which the refresh was incomplete for other reasons.
+        Get all refreshable tokens which expire within a number of seconds, including those already expired.
+        :param seconds: Seconds from now.
+        :return: Tokens expiring soonest first, read in order from the expiry index rather than sorted.
+        :rtype: :class:`esi.managers.TokenQueryset`
+        """
+        return self._expiring_before(timezone.now() + timedelta(seconds=seconds)).filter(
+            refresh_token__isnull=False).exclude(refresh_token='').order_by('expires_at')
+
+    def _refresh_all(self, max_workers=None):
+        """
+        Refreshes all refreshable tokens in the queryset, several at once. Requests to the SSO are sent from
+        worker threads over a shared connection pool, while the database is only written from this thread.
+        Deletes any tokens which fail to refresh, and any tokens which are expired and cannot refresh.
+        Refreshed tokens are saved, and failed tokens deleted, ESI_TOKEN_REFRESH_BATCH_SIZE at a time.
+        Any other error stops the refresh, and is raised once the tokens already refreshed are saved.
+        :param max_workers: Maximum number of tokens refreshed at once. Defaults to ESI_TOKEN_REFRESH_MAX_WORKERS.
+        :return: tuple of summary dict and primary keys of tokens for which the refresh was incomplete
         """
-        session = OAuth2Session(app_settings.ESI_SSO_CLIENT_ID)
+        started = time.time()
+        max_workers = max_workers or app_settings.ESI_TOKEN_REFRESH_MAX_WORKERS
         auth = requests.auth.HTTPBasicAuth(app_settings.ESI_SSO_CLIENT_ID, app_settings.ESI_SSO_CLIENT_SECRET)
-        incomplete = []
-        for model in self.filter(refresh_token__isnull=False):
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        # sessions store the token they last refreshed, so each worker needs its own
+        local = threading.local()
+        # set once refreshing should stop, so queued tokens are skipped
+        stop = threading.Event()
+        errors = []
+
+        def refresh(model):
+            if stop.is_set():
+                return model, None, 0.0
+            if not hasattr(local, 'session'):
+                local.session = OAuth2Session(app_settings.ESI_SSO_CLIENT_ID)
+                local.session.mount('https://', adapter)
+                local.session.mount('http://', adapter)
+            refresh_started = time.time()
             try:
-                model.refresh(session=session, auth=auth)
-                logging.debug("Successfully refreshed {0}".format(repr(model)))
+                model.refresh(session=local.session, auth=auth, commit=False)
+                outcome = 'refreshed'
             except TokenError:
-                logger.info("Refresh failed for {0}. Deleting.".format(repr(model)))
-                model.delete()
+                outcome = 'deleted'
             except IncompleteResponseError:
-                incomplete.append(model.pk)
-        self.filter(refresh_token__isnull=True).get_expired().delete()
+                outcome = 'incomplete'
+            except Exception:
+                # raised once the refreshes in flight are saved
+                errors.append(sys.exc_info())
+                stop.set()
+                outcome = None
+            return model, outcome, time.time() - refresh_started
+
+        summary = {'refreshed': 0, 'deleted': 0, 'incomplete': 0, 'refresh_time': 0.0}
+        incomplete = []
+        refreshed = []
+        failed = []
+        batch_size = app_settings.ESI_TOKEN_REFRESH_BATCH_SIZE
+        models_to_refresh = list(self.filter(refresh_token__isnull=False))
+        pool = ThreadPool(min(max_workers, len(models_to_refresh)) or 1)
+        results = pool.imap_unordered(refresh, models_to_refresh)
+        try:
+            for model, outcome, latency in results:
+                if outcome is None:
+                    continue
+                summary[outcome] += 1
+                summary['refresh_time'] += latency
+                if outcome == 'refreshed':
+                    logger.debug("Successfully refreshed {0}".format(repr(model)))
+                    refreshed.append(model)
+                    if len(refreshed) >= batch_size:
+                        self._save_refreshed(refreshed)
+                        refreshed = []
+                elif outcome == 'deleted':
+                    logger.info("Refresh failed for {0}. Deleting.".format(repr(model)))
+                    failed.append(model.pk)
+                else:
+                    incomplete.append(model.pk)
+        finally:
+            # let the refreshes in flight finish without starting any more
+            stop.set()
+            pool.close()
+            pool.join()
+            adapter.close()
+            # keep the tokens already refreshed, including any not yet handled, as the SSO has revoked
+            # their old refresh tokens
+            refreshed.extend(model for model, outcome, _ in results if outcome == 'refreshed')
+            self._save_refreshed(refreshed)
+        if errors:
+            reraise(*errors[0])
+        for pks in _chunks(failed, batch_size):
+            self.model.objects.filter(pk__in=pks).delete()
+        _, deleted = self.filter(refresh_token__isnull=True).get_expired().delete()
+        summary['deleted'] += deleted.get(self.model._meta.label, 0)
+        summary['duration'] = time.time() - started
+        return summary, incomplete
+
+    def _save_refreshed(self, tokens):
+        """
+        Saves the new access and refresh tokens of refreshed models
+        :param tokens: list of :class:`esi.models.Token`
+        """
+        if not tokens:
+            return
+        fields = ['access_token', 'refresh_token', 'created', 'expires_at']
+        if hasattr(self, 'bulk_update'):
+            self.model.objects.bulk_update(tokens, fields, batch_size=app_settings.ESI_TOKEN_REFRESH_BATCH_SIZE)
+        else:
+            # Django < 2.2
+            with transaction.atomic():
+                for token in tokens:
+                    self.model.objects.filter(pk=token.pk).update(**{f: getattr(token, f) for f in fields})
+
+    def bulk_refresh(self, max_workers=None):
+        """
+        Refreshes all refreshable tokens in the queryset.
+        Deletes any tokens which fail to refresh.
+        Deletes any tokens which are expired and cannot refresh.
+        Excludes tokens for which the refresh was incomplete for other reasons.
+        :param max_workers: Maximum number of tokens refreshed at once. Defaults to ESI_TOKEN_REFRESH_MAX_WORKERS.
+        :return: All tokens which were not deleted or left incomplete.
+        :rtype: :class:`esi.managers.TokenQueryset`
+        """
+        _, incomplete = self._refresh_all(max_workers=max_workers)
         return self.exclude(pk__in=incomplete)
 
+    def refresh_all(self, max_workers=None):
+        """
+        Refreshes all refreshable tokens in the queryset as with `bulk_refresh()`, summarising the outcome.
+        :param max_workers: Maximum number of tokens refreshed at once. Defaults to ESI_TOKEN_REFRESH_MAX_WORKERS.
+        :return: dict of the number of tokens "refreshed", "deleted" and left "incomplete", the "duration" in
+        seconds and the "refresh_time" spent waiting on the SSO, summed over all tokens
+        """
+        summary, _ = self._refresh_all(max_workers=max_workers)
+        return summary
+
     def require_valid(self):
         """
         Ensures all tokens are still valid. If expired, attempts to refresh.
@@ -64,9 +221,9 @@ class TokenQueryset(models.QuerySet):
         :return: All tokens which are still valid.
         :rtype: :class:`esi.managers.TokenQueryset`
         """
-        expired = self.get_expired()
-        valid = self.exclude(pk__in=expired)
-        valid_expired = expired.bulk_refresh()
+        now = timezone.now()
+        valid = self._valid_at(now)
+        valid_expired = self._expiring_before(now).bulk_refresh()
         return valid_expired | valid
 
     def require_scopes(self, scope_string):
@@ -80,15 +237,12 @@ class TokenQueryset(models.QuerySet):
         if not scopes:
             # asking for tokens with no scopes
             return self.filter(scopes__isnull=True)
-        from .models import Scope
-        scope_pks = Scope.objects.filter(name__in=scopes).values_list('pk', flat=True)
-        if not len(scopes) == len(scope_pks):
-            # there's a scope we don't recognize, so we can't have any tokens for it
-            return self.none()
-        tokens = self.all()
-        for pk in scope_pks:
-            tokens = tokens.filter(scopes__pk=pk)
-        return tokens
+        # tokens granted every scope have one row in the scopes table for each, counted in a single grouped query
+        # whatever the number of scopes. Scopes which don't exist can't be matched, so no tokens are returned for them.
+        through = self.model.scopes.through
+        matching = through.objects.filter(scope__name__in=scopes).values('token_id').annotate(
+            matched=models.Count('scope_id')).filter(matched=len(scopes)).values('token_id')
+        return self.filter(pk__in=matching)
 
     def require_scopes_exact(self, scope_string):
         """
@@ -97,10 +251,7 @@ class TokenQueryset(models.QuerySet):
         :return: The tokens with only the requested scopes.
         :rtype: :class:`esi.managers.TokenQueryset`
         """
-        num_scopes = len(_process_scopes(scope_string))
-        pks = [v['pk'] for v in self.annotate(models.Count('scopes')).require_scopes(scope_string).filter(
-            scopes__count=num_scopes).values('pk', 'scopes__id')]
-        return self.filter(pk__in=pks)
+        return self.filter(scopes_fingerprint=scopes_fingerprint(_process_scopes(scope_string)))
 
     def equivalent_to(self, token):
         """
@@ -108,9 +259,30 @@ class TokenQueryset(models.QuerySet):
         :param token: :class:`esi.models.Token`
         :return: :class:`esi.managers.TokenQueryset`
         """
-        return self.filter(character_id=token.character_id).require_scopes_exact(token.scopes.all()).filter(
+        return self.filter(character_id=token.character_id, scopes_fingerprint=token.scopes_fingerprint).filter(
             models.Q(user=token.user) | models.Q(user__isnull=True)).exclude(pk=token.pk)
 
+    def update_scopes_fingerprints(self):
+        """
+        Recalculates the scopes fingerprint of each token. Fingerprints are kept up to date when scopes are
+        changed through `Token.scopes` or `Scope.token_set`, but not when the scopes table is written to
+        directly, such as with `bulk_create()` of `Token.scopes.through` models. Call this afterwards.
+        """
+        batch_size = 500
+        through = self.model.scopes.through
+        pks = list(self.values_list('pk', flat=True))
+        names = defaultdict(list)
+        for chunk in _chunks(pks, batch_size):
+            for token_id, name in through.objects.filter(token_id__in=chunk).values_list('token_id', 'scope__name'):
+                names[token_id].append(name)
+        fingerprints = defaultdict(list)
+        for pk in pks:
+            fingerprints[scopes_fingerprint(names[pk])].append(pk)
+        with transaction.atomic():
+            for fingerprint, token_pks in fingerprints.items():
+                for chunk in _chunks(token_pks, batch_size):
+                    self.model.objects.filter(pk__in=chunk).update(scopes_fingerprint=fingerprint)
+
 
 class TokenManager(models.Manager):
     def get_queryset(self):
@@ -179,6 +351,7 @@ class TokenManager(models.Manager):
                     access_token=model.access_token,
                     refresh_token=model.refresh_token,
                     created=model.created,
+                    expires_at=model.expires_at,
                 )
                 if queryset.filter(user=model.user).exists():
                     logger.debug("Equivalent token with same user exists. Deleting new token.")
@@ -0,0 +1,207 @@
+"""
+Collects and exports metrics of ESI requests, from the signals in :mod:`esi.signals`.
+"""
+from __future__ import unicode_literals
+from collections import Counter, defaultdict
+from esi import app_settings, signals
+import threading
+import socket
+import logging
+
+logger = logging.getLogger(__name__)
+
+# upper bounds in seconds of the request latency histogram
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class _OperationMetrics(object):
+    def __init__(self):
+        self.requests = Counter()  # (status code, cache status): count
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS)
+        self.latency_sum = 0.0
+        self.bytes = 0
+        self.retries = 0
+
+    @property
+    def count(self):
+        return sum(self.requests.values())
+
+
+class MetricsAggregator(object):
+    """
+    Thread-safe in-process totals of ESI requests by operation ID, and of token refreshes.
+    Call `connect()` to start receiving signals.
+    """
+    def __init__(self):
+        self._operations = defaultdict(_OperationMetrics)
+        self._token_refreshes = 0
+        self._token_refresh_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def connect(self):
+        signals.esi_request.connect(self.record_request, weak=False, dispatch_uid=('esi_metrics', id(self)))
+        signals.token_refreshed.connect(self.record_token_refresh, weak=False, dispatch_uid=('esi_metrics', id(self)))
+
+    def disconnect(self):
+        signals.esi_request.disconnect(dispatch_uid=('esi_metrics', id(self)))
+        signals.token_refreshed.disconnect(dispatch_uid=('esi_metrics', id(self)))
+
+    def record_request(self, operation_id, status_code, cache, latency, size, retries, **kwargs):
+        with self._lock:
+            metrics = self._operations[operation_id]
+            metrics.requests[(status_code, cache)] += 1
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    metrics.latency_buckets[i] += 1
+            metrics.latency_sum += latency
+            metrics.bytes += size
+            metrics.retries += retries
+
+    def record_token_refresh(self, latency, **kwargs):
+        with self._lock:
+            self._token_refreshes += 1
+            self._token_refresh_seconds += latency
+
+    def reset(self):
+        with self._lock:
+            self._operations.clear()
+            self._token_refreshes = 0
+            self._token_refresh_seconds = 0.0
+
+    def snapshot(self):
+        """
+        Summarises the totals
+        :return: dict of {'operations': {operation ID: totals}, 'token_refreshes': count}
+        """
+        with self._lock:
+            operations = {}
+            for operation_id, metrics in self._operations.items():
+                cache, status = Counter(), Counter()
+                for (status_code, cache_status), count in metrics.requests.items():
+                    status[status_code] += count
+                    if cache_status:
+                        cache[cache_status] += count
+                operations[operation_id] = {
+                    'requests': metrics.count,
+                    'status': dict(status),
+                    'cache': dict(cache),
+                    'latency_avg': metrics.latency_sum / metrics.count,
+                    'bytes': metrics.bytes,
+                    'retries': metrics.retries,
+                }
+            return {'operations': operations, 'token_refreshes': self._token_refreshes}
+
+    def to_prometheus(self):
+        """
+        Formats the totals in the Prometheus text exposition format, to be served to a Prometheus scraper
+        :return: str
+        """
+        lines = [
+            '# HELP esi_requests_total ESI operation results by response status and cache status.',
+            '# TYPE esi_requests_total counter',
+        ]
+        with self._lock:
+            operations = sorted(self._operations.items())
+            for operation_id, metrics in operations:
+                for (status_code, cache_status), count in sorted(metrics.requests.items(), key=str):
+                    lines.append('esi_requests_total{{operation="{0}",status="{1}",cache="{2}"}} {3}'.format(
+                        operation_id, status_code or '', cache_status or '', count))
+
+            lines.extend([
+                '# HELP esi_request_duration_seconds Time taken to return ESI operation results.',
+                '# TYPE esi_request_duration_seconds histogram',
+            ])
+            for operation_id, metrics in operations:
+                for bound, count in zip(LATENCY_BUCKETS, metrics.latency_buckets):
+                    lines.append('esi_request_duration_seconds_bucket{{operation="{0}",le="{1}"}} {2}'.format(
+                        operation_id, bound, count))
+                lines.append('esi_request_duration_seconds_bucket{{operation="{0}",le="+Inf"}} {1}'.format(
+                    operation_id, metrics.count))
+                lines.append('esi_request_duration_seconds_sum{{operation="{0}"}} {1}'.format(
+                    operation_id, metrics.latency_sum))
+                lines.append('esi_request_duration_seconds_count{{operation="{0}"}} {1}'.format(
+                    operation_id, metrics.count))
+
+            lines.extend([
+                '# HELP esi_response_bytes_total Bytes of response bodies received from ESI.',
+                '# TYPE esi_response_bytes_total counter',
+            ])
+            lines.extend('esi_response_bytes_total{{operation="{0}"}} {1}'.format(operation_id, metrics.bytes)
+                         for operation_id, metrics in operations)
+            lines.extend([
+                '# HELP esi_retries_total Retries of failed ESI requests.',
+                '# TYPE esi_retries_total counter',
+            ])
+            lines.extend('esi_retries_total{{operation="{0}"}} {1}'.format(operation_id, metrics.retries)
+                         for operation_id, metrics in operations)
+
+            lines.extend([
+                '# HELP esi_token_refreshes_total Expired tokens refreshed before requests.',
+                '# TYPE esi_token_refreshes_total counter',
+                'esi_token_refreshes_total {0}'.format(self._token_refreshes),
+                '# HELP esi_token_refresh_seconds_total Time spent refreshing expired tokens before requests.',
+                '# TYPE esi_token_refresh_seconds_total counter',
+                'esi_token_refresh_seconds_total {0}'.format(self._token_refresh_seconds),
+            ])
+        return '\n'.join(lines) + '\n'
+
+
+class StatsdExporter(object):
+    """
+    Sends each ESI request and token refresh to a statsd server over UDP as it happens.
+    Call `connect()` to start receiving signals.
+    """
+    def __init__(self, host, port=8125, prefix='esi'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def connect(self):
+        signals.esi_request.connect(self.record_request, weak=False, dispatch_uid=('esi_statsd', id(self)))
+        signals.token_refreshed.connect(self.record_token_refresh, weak=False, dispatch_uid=('esi_statsd', id(self)))
+
+    def disconnect(self):
+        signals.esi_request.disconnect(dispatch_uid=('esi_statsd', id(self)))
+        signals.token_refreshed.disconnect(dispatch_uid=('esi_statsd', id(self)))
+
+    def _send(self, lines):
+        try:
+            self._socket.sendto('\n'.join(lines).encode('utf-8'), self.address)
+        except (socket.error, socket.gaierror) as e:
+            logger.debug("Failed to send ESI metrics to statsd: {0}".format(e))
+
+    def record_request(self, operation_id, status_code, cache, latency, size, retries, **kwargs):
+        name = '{0}.{1}'.format(self.prefix, operation_id)
+        lines = [
+            '{0}.requests:1|c'.format(name),
+            '{0}.status.{1}:1|c'.format(name, status_code or 'none'),
+            '{0}.latency:{1:.3f}|ms'.format(name, latency * 1000),
+        ]
+        if cache:
+            lines.append('{0}.cache.{1}:1|c'.format(name, cache))
+        if size:
+            lines.append('{0}.bytes:{1}|c'.format(name, size))
+        if retries:
+            lines.append('{0}.retries:{1}|c'.format(name, retries))
+        self._send(lines)
+
+    def record_token_refresh(self, latency, **kwargs):
+        self._send([
+            '{0}.token_refreshes:1|c'.format(self.prefix),
+            '{0}.token_refresh_latency:{1:.3f}|ms'.format(self.prefix, latency * 1000),
+        ])
+
+
+# process-wide aggregator, connected on startup when ESI_METRICS is enabled
+aggregator = MetricsAggregator()
+
+
+def setup():
+    """
+    Connects the metrics collectors enabled in settings
+    """
+    if app_settings.ESI_METRICS:
+        aggregator.connect()
+    if app_settings.ESI_METRICS_STATSD_HOST:
+        StatsdExporter(app_settings.ESI_METRICS_STATSD_HOST, app_settings.ESI_METRICS_STATSD_PORT,
+                       app_settings.ESI_METRICS_STATSD_PREFIX).connect()
@@ -0,0 +1,38 @@
+# Generated by Django 2.0.4 on 2018-06-02 14:21
+
+from datetime import timedelta
+from django.db import migrations, models
+from django.db.models import ExpressionWrapper, F
+
+
+def populate_expires_at(apps, schema_editor):
+    from esi import app_settings
+    Token = apps.get_model('esi', 'Token')
+    Token.objects.update(expires_at=ExpressionWrapper(
+        F('created') + timedelta(seconds=app_settings.ESI_TOKEN_VALID_DURATION), output_field=models.DateTimeField()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('esi', '0005_remove_token_length_limit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='token',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, help_text='When the access token expires. Set on save from ESI_TOKEN_VALID_DURATION.', null=True),
+        ),
+        migrations.AlterField(
+            model_name='token',
+            name='character_id',
+            field=models.IntegerField(db_index=True, help_text='The ID of the EVE character who authenticated by SSO.'),
+        ),
+        migrations.AlterField(
+            model_name='token',
+            name='character_owner_hash',
+            field=models.CharField(db_index=True, help_text='The unique string identifying this character and its owning EVE account. Changes if the owning account changes.', max_length=254),
+        ),
+        migrations.RunPython(populate_expires_at, migrations.RunPython.noop),
+    ]
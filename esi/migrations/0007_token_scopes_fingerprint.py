@@ -0,0 +1,34 @@
+# Generated by Django 2.0.4 on 2018-06-09 11:03
+
+from collections import defaultdict
+from hashlib import md5
+from django.db import migrations, models
+
+
+def populate_scopes_fingerprint(apps, schema_editor):
+    Token = apps.get_model('esi', 'Token')
+    names = defaultdict(list)
+    for token_id, name in Token.scopes.through.objects.values_list('token_id', 'scope__name'):
+        names[token_id].append(name)
+    fingerprints = defaultdict(list)
+    for pk in Token.objects.values_list('pk', flat=True):
+        fingerprints[md5(' '.join(sorted(set(names[pk]))).encode('utf-8')).hexdigest()].append(pk)
+    for fingerprint, pks in fingerprints.items():
+        for i in range(0, len(pks), 500):
+            Token.objects.filter(pk__in=pks[i:i + 500]).update(scopes_fingerprint=fingerprint)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('esi', '0006_token_expires_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='token',
+            name='scopes_fingerprint',
+            field=models.CharField(db_index=True, default='d41d8cd98f00b204e9800998ecf8427e', editable=False, help_text='Identifies the set of scopes granted, to find tokens with exactly the same scopes.', max_length=32),
+        ),
+        migrations.RunPython(populate_scopes_fingerprint, migrations.RunPython.noop),
+    ]
@@ -8,7 +8,9 @@ from django.utils import timezone
 from esi.clients import esi_client_factory
 import datetime
 from requests_oauthlib import OAuth2Session
-from esi.managers import TokenManager
+from esi.managers import TokenManager, scopes_fingerprint, NO_SCOPES_FINGERPRINT
+from django.db.models.signals import m2m_changed, pre_delete, post_delete
+from django.dispatch import receiver
 from esi.errors import TokenInvalidError, NotRefreshableTokenError, TokenExpiredError, IncompleteResponseError
 from oauthlib.oauth2.rfc6749.errors import InvalidGrantError, MissingTokenError, InvalidClientError, InvalidTokenError, InvalidClientIdError
 from django.core.exceptions import ImproperlyConfigured
@@ -47,6 +49,9 @@ class Token(models.Model):
     """
 
     created = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(null=True, blank=True, editable=False, db_index=True,
+                                      help_text="When the access token expires. Set on save from "
+                                                "ESI_TOKEN_VALID_DURATION.")
     access_token = models.TextField(help_text="The access token granted by SSO.",
                                     editable=False)
     refresh_token = models.TextField(blank=True, default='',
@@ -54,15 +59,18 @@ class Token(models.Model):
                                      editable=False)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, blank=True, null=True,
                              help_text="The user to whom this token belongs.")
-    character_id = models.IntegerField(help_text="The ID of the EVE character who authenticated by SSO.")
+    character_id = models.IntegerField(db_index=True, help_text="The ID of the EVE character who authenticated by SSO.")
     character_name = models.CharField(max_length=100,
                                       help_text="The name of the EVE character who authenticated by SSO.")
     token_type = models.CharField(max_length=100, choices=(('Character', 'Character'), ('Corporation', 'Corporation'),),
                                   default='Character', help_text="The applicable range of the token.")
-    character_owner_hash = models.CharField(max_length=254,
+    character_owner_hash = models.CharField(max_length=254, db_index=True,
                                             help_text="The unique string identifying this character and its owning EVE "
                                                       "account. Changes if the owning account changes.")
     scopes = models.ManyToManyField(Scope, blank=True, help_text="The access scopes granted by this token.")
+    scopes_fingerprint = models.CharField(max_length=32, default=NO_SCOPES_FINGERPRINT, editable=False, db_index=True,
+                                          help_text="Identifies the set of scopes granted, to find tokens with "
+                                                    "exactly the same scopes.")
 
     objects = TokenManager()
 
@@ -77,6 +85,19 @@ class Token(models.Model):
             self.character_name,
         )
 
+    def save(self, *args, **kwargs):
+        # new tokens are given their creation time by the field while saving, a moment later
+        created = self.created or timezone.now()
+        self.expires_at = created + datetime.timedelta(seconds=app_settings.ESI_TOKEN_VALID_DURATION)
+        super(Token, self).save(*args, **kwargs)
+
+    def update_scopes_fingerprint(self):
+        """
+        Recalculates the fingerprint of the scopes granted to this token.
+        """
+        self.scopes_fingerprint = scopes_fingerprint(self.scopes.values_list('name', flat=True))
+        Token.objects.filter(pk=self.pk).update(scopes_fingerprint=self.scopes_fingerprint)
+
     @property
     def can_refresh(self):
         """
@@ -89,6 +110,8 @@ class Token(models.Model):
         """
         Determines when the token expires.
         """
+        if self.expires_at:
+            return self.expires_at
         return self.created + datetime.timedelta(seconds=app_settings.ESI_TOKEN_VALID_DURATION)
 
     @property
@@ -98,11 +121,12 @@ class Token(models.Model):
         """
         return self.expires < timezone.now()
 
-    def refresh(self, session=None, auth=None):
+    def refresh(self, session=None, auth=None, commit=True):
         """
         Refreshes the token.
         :param session: :class:`requests_oauthlib.OAuth2Session` for refreshing token with.
         :param auth: :class:`requests.auth.HTTPBasicAuth`
+        :param commit: Save the refreshed token. If False, only the model instance is updated.
         """
         logger.debug("Attempting refresh of {0}".format(repr(self)))
         if self.can_refresh:
@@ -116,7 +140,9 @@ class Token(models.Model):
                 self.access_token = token['access_token']
                 self.refresh_token = token['refresh_token']
                 self.created = timezone.now()
-                self.save()
+                self.expires_at = self.created + datetime.timedelta(seconds=app_settings.ESI_TOKEN_VALID_DURATION)
+                if commit:
+                    self.save()
                 logger.debug("Successfully refreshed {0}".format(repr(self)))
             except (InvalidGrantError, InvalidTokenError, InvalidClientIdError) as e:
                 logger.info("Refresh failed for {0}: {1}".format(repr(self), e))
@@ -162,6 +188,41 @@ class Token(models.Model):
             self.save()
 
 
+@receiver(m2m_changed, sender=Token.scopes.through)
+def update_scopes_fingerprint(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keeps the scopes fingerprint of tokens up to date as scopes are added or removed,
+    from either side of the relation
+    """
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            instance.update_scopes_fingerprint()
+    elif action == 'pre_clear':
+        # the tokens losing this scope can't be found once it's cleared
+        instance._cleared_token_pks = list(instance.token_set.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        pks = pk_set if action != 'post_clear' else getattr(instance, '_cleared_token_pks', [])
+        Token.objects.filter(pk__in=pks).update_scopes_fingerprints()
+
+
+@receiver(pre_delete, sender=Scope)
+def record_scope_tokens(sender, instance, **kwargs):
+    """
+    Remembers the tokens granted a scope being deleted, as its relations are deleted without `m2m_changed`
+    """
+    instance._deleted_token_pks = list(instance.token_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Scope)
+def update_deleted_scope_fingerprints(sender, instance, **kwargs):
+    """
+    Recalculates the scopes fingerprint of tokens which were granted a deleted scope
+    """
+    pks = getattr(instance, '_deleted_token_pks', None)
+    if pks:
+        Token.objects.filter(pk__in=pks).update_scopes_fingerprints()
+
+
 @python_2_unicode_compatible
 class CallbackRedirect(models.Model):
     """
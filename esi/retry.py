@@ -0,0 +1,117 @@
+"""
+Retries of idempotent requests which failed due to transient ESI or network problems.
+"""
+from __future__ import unicode_literals
+from email.utils import parsedate_tz, mktime_tz
+from esi import app_settings, throttle
+from esi.cache import Statistics
+import threading
+import random
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_METHODS = ('GET', 'HEAD')
+
+# counts of "retried" attempts, requests "recovered" by retrying, and failed requests which "gave_up"
+# without being retried further, in this process
+retry_stats = Statistics()
+
+
+class RetryBudget(object):
+    """
+    Thread-safe token bucket limiting the retries made by this process, so a systemic outage
+    doesn't multiply the load on ESI. Holds up to `capacity` retries, refilled at `rate` per second.
+    """
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self._tokens = float(capacity)
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def withdraw(self):
+        """
+        Takes a retry from the budget
+        :return: True if one was available
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+retry_budget = RetryBudget(app_settings.ESI_RETRY_BUDGET,
+                           app_settings.ESI_RETRY_BUDGET / float(app_settings.ESI_RETRY_BUDGET_PERIOD))
+
+
+def parse_retry_after(response):
+    """
+    Reads the delay requested by a response's "Retry-After" header
+    :param response: :class:`bravado_core.response.IncomingResponse`
+    :return: seconds to wait, or None if not given
+    """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        parsed = parsedate_tz(value)
+        if parsed is None:
+            return None
+        return max(mktime_tz(parsed) - time.time(), 0)
+
+
+class RetryTracker(object):
+    """
+    Decides whether and when a single request is sent again after a failed attempt.
+    """
+    def __init__(self, method):
+        self.retryable = method.upper() in RETRYABLE_METHODS
+        self.attempts = 0
+
+    def _give_up(self, reason):
+        retry_stats.incr('gave_up')
+        logger.warning("Giving up on ESI request after {0} retries: {1}.".format(self.attempts, reason))
+        return None
+
+    def backoff(self, response=None):
+        """
+        Determines the wait before the next attempt, with exponential backoff and full jitter.
+        :param response: :class:`bravado_core.response.IncomingResponse` of the last attempt, or None if it
+        failed to connect
+        :return: seconds to wait before retrying, or None if the request is complete or should not be retried
+        """
+        if response is not None and response.status_code not in app_settings.ESI_RETRY_STATUS_CODES:
+            if self.attempts:
+                retry_stats.incr('recovered')
+            return None
+        if not self.retryable:
+            return None
+        if self.attempts >= app_settings.ESI_RETRIES:
+            return self._give_up('attempts exhausted')
+        error_limit = throttle.get_error_limit()
+        if error_limit and error_limit[0] <= app_settings.ESI_ERROR_LIMIT_PAUSE:
+            # leave the remaining errors to requests which haven't failed yet
+            return self._give_up('error limit nearly exhausted')
+
+        delay = parse_retry_after(response) if response is not None else None
+        if delay is None:
+            delay = random.uniform(0, min(app_settings.ESI_RETRY_BACKOFF_MAX,
+                                          app_settings.ESI_RETRY_BACKOFF * 2 ** self.attempts))
+        elif delay > app_settings.ESI_RETRY_BACKOFF_MAX:
+            return self._give_up('Retry-After of {0:.0f}s'.format(delay))
+        if not retry_budget.withdraw():
+            return self._give_up('retry budget exhausted')
+
+        self.attempts += 1
+        retry_stats.incr('retried')
+        logger.debug("Retrying ESI request in {0:.2f}s after {1}.".format(
+            delay, 'status {0}'.format(response.status_code) if response is not None else 'connection error'))
+        return delay
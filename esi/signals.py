@@ -0,0 +1,18 @@
+from __future__ import unicode_literals
+from django.dispatch import Signal
+
+# Sent by ESI futures once an operation's result is retrieved or fails. Arguments:
+#  - future: the future the result was requested from
+#  - operation_id: ID of the operation called
+#  - method: HTTP method of the request
+#  - status_code: status of the response, from the cache or ESI, or None if no response was received
+#  - cache: "hit", "miss", "revalidated" or "stale" for cacheable requests, otherwise None
+#  - latency: seconds taken to return the result
+#  - size: bytes of response body received from ESI, 0 if served from the cache
+#  - retries: number of times the request was retried
+esi_request = Signal()
+
+# Sent by TokenAuthenticator after refreshing an expired token before a request. Arguments:
+#  - token: the refreshed :class:`esi.models.Token`
+#  - latency: seconds taken to refresh the token
+token_refreshed = Signal()
@@ -1,9 +1,13 @@
 from __future__ import unicode_literals
 from django.utils import timezone
+from django.core.cache import cache
 from datetime import timedelta
 from esi.models import CallbackRedirect, Token
+from esi import app_settings
+from esi.clients import esi_client_factory
 from celery import shared_task
 import logging
+import random
 
 
 logger = logging.getLogger(__name__)
@@ -24,6 +28,72 @@ def cleanup_callbackredirect(max_age=300):
 def cleanup_token():
     """
     Delete expired :model:`esi.Token` models.
+    Returns the number of tokens refreshed, deleted and left incomplete, as from
+    :meth:`esi.managers.TokenQueryset.refresh_all`.
     """
     logger.debug("Triggering bulk refresh of all expired tokens.")
-    Token.objects.all().get_expired().bulk_refresh()
+    summary = Token.objects.all().get_expired().refresh_all()
+    logger.info("Refreshed {refreshed} expired tokens, deleted {deleted}, {incomplete} incomplete in "
+                "{duration:.1f}s.".format(**summary))
+    return summary
+
+
+def _refresh_claim_key(pk):
+    return 'esi_token_refresh_{0}'.format(pk)
+
+
+@shared_task
+def refresh_expiring_tokens():
+    """
+    Queues refreshes of :model:`esi.Token` models expiring within ESI_TOKEN_REFRESH_AHEAD seconds, so they
+    are refreshed before being needed. Schedule every ESI_TOKEN_REFRESH_INTERVAL seconds.
+    At most ESI_TOKEN_REFRESH_MAX_PER_RUN tokens are queued per run, in chunks spread evenly over the interval.
+    Tokens already queued by an earlier run are skipped until their refresh has finished.
+    """
+    pks = []
+    for pk in Token.objects.all().get_expiring(app_settings.ESI_TOKEN_REFRESH_AHEAD).values_list(
+            'pk', flat=True).iterator():
+        if len(pks) >= app_settings.ESI_TOKEN_REFRESH_MAX_PER_RUN:
+            break
+        # refreshing a token twice at once revokes the refresh token one of them is using, so claim each token.
+        # Claims are released by refresh_tokens, and expire in case its task is lost.
+        if cache.add(_refresh_claim_key(pk), True, app_settings.ESI_TOKEN_VALID_DURATION):
+            pks.append(pk)
+    chunk_size = app_settings.ESI_TOKEN_REFRESH_CHUNK_SIZE
+    chunks = [pks[i:i + chunk_size] for i in range(0, len(pks), chunk_size)]
+    for i, chunk in enumerate(chunks):
+        # each chunk runs at a random time within its share of the interval
+        countdown = app_settings.ESI_TOKEN_REFRESH_INTERVAL * (i + random.random()) / len(chunks)
+        refresh_tokens.apply_async(args=[chunk], countdown=countdown)
+    logger.debug("Queued refresh of {0} expiring tokens in {1} chunks.".format(len(pks), len(chunks)))
+    return len(pks)
+
+
+@shared_task
+def refresh_tokens(pks):
+    """
+    Refreshes :model:`esi.Token` models which are still expiring, queued by `refresh_expiring_tokens`.
+    Returns the number of tokens refreshed, deleted and left incomplete.
+    """
+    try:
+        return Token.objects.filter(pk__in=pks).get_expiring(app_settings.ESI_TOKEN_REFRESH_AHEAD).refresh_all()
+    finally:
+        cache.delete_many([_refresh_claim_key(pk) for pk in pks])
+
+
+@shared_task
+def refresh_cached_response(resource, operation, op_kwargs, token_pk=None, client_kwargs=None, raw=False):
+    """
+    Retrieves an ESI response again to replace its stale cache entry.
+    Queued by :class:`esi.clients.CachingHttpFuture` when serving stale responses.
+    """
+    token = None
+    if token_pk:
+        try:
+            token = Token.objects.get(pk=token_pk)
+        except Token.DoesNotExist:
+            logger.debug("Token {0} was deleted before refreshing {1}.".format(token_pk, operation))
+            return
+    client = esi_client_factory(token=token, **(client_kwargs or {}))
+    logger.debug("Refreshing cached response of {0}({1})".format(operation, op_kwargs))
+    getattr(getattr(client, resource), operation)(_request_options={'raw': raw}, **op_kwargs).refresh()
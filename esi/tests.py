@@ -0,0 +1,208 @@
+from __future__ import unicode_literals
+from django.test import TestCase
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from unittest import skipUnless
+from django.core.cache import cache
+from django.utils import timezone
+from datetime import timedelta
+from esi.models import Token, Scope
+from esi.managers import scopes_fingerprint
+from esi import app_settings
+from esi import tasks
+from esi.clients import IdBatcher
+from bravado.exception import HTTPNotFound
+try:
+    from unittest import mock
+except ImportError:
+    # Python 2
+    import mock
+import time
+
+
+class ScopesFingerprintTestCase(TestCase):
+    def setUp(self):
+        self.scope_a = Scope.objects.create(name='x.a', help_text='A')
+        self.scope_b = Scope.objects.create(name='x.b', help_text='B')
+        self.token = Token.objects.create(character_id=1, character_name='Character', character_owner_hash='hash',
+                                          access_token='access', refresh_token='refresh')
+        self.token.scopes.add(self.scope_a, self.scope_b)
+
+    def test_scopes_added(self):
+        self.assertEqual(list(Token.objects.all().require_scopes_exact(['x.a', 'x.b'])), [self.token])
+        self.assertEqual(list(Token.objects.all().require_scopes_exact(['x.a'])), [])
+
+    def test_require_scopes(self):
+        other = Token.objects.create(character_id=2, character_name='Other', character_owner_hash='hash',
+                                     access_token='access', refresh_token='refresh')
+        other.scopes.add(self.scope_a)
+        self.assertEqual(list(Token.objects.all().require_scopes(['x.a', 'x.b'])), [self.token])
+        self.assertEqual(list(Token.objects.all().require_scopes('x.b x.a')), [self.token])
+        self.assertEqual(set(Token.objects.all().require_scopes(['x.a'])), {self.token, other})
+        self.assertEqual(list(Token.objects.all().require_scopes(['x.a', 'x.c'])), [])
+
+    def test_scope_removed_from_scope(self):
+        self.scope_b.token_set.remove(self.token)
+        self.assertEqual(list(Token.objects.all().require_scopes_exact(['x.a'])), [self.token])
+
+    def test_scope_deleted(self):
+        self.scope_b.delete()
+        self.assertEqual(list(Token.objects.all().require_scopes_exact(['x.a'])), [self.token])
+        self.assertEqual(list(Token.objects.all().require_scopes_exact(['x.a', 'x.b'])), [])
+
+    def test_scopes_deleted_in_bulk(self):
+        Scope.objects.filter(name__startswith='x.').delete()
+        self.assertEqual(list(Token.objects.all().require_scopes_exact([])), [self.token])
+
+
+class RefreshExpiringTokensTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        for character_id in range(3):
+            token = Token.objects.create(character_id=character_id, character_name='Character',
+                                         character_owner_hash='hash', access_token='access', refresh_token='refresh')
+            # expiring within ESI_TOKEN_REFRESH_AHEAD
+            Token.objects.filter(pk=token.pk).update(expires_at=timezone.now() + timedelta(seconds=10))
+
+    @mock.patch('esi.tasks.refresh_tokens.apply_async')
+    def test_tokens_queued_once(self, apply_async):
+        self.assertEqual(tasks.refresh_expiring_tokens(), 3)
+        self.assertEqual(tasks.refresh_expiring_tokens(), 0)
+        queued = [pk for call in apply_async.call_args_list for pk in call[1]['args'][0]]
+        self.assertEqual(sorted(queued), sorted(Token.objects.values_list('pk', flat=True)))
+
+    @mock.patch('esi.managers.TokenQueryset.refresh_all')
+    @mock.patch('esi.tasks.refresh_tokens.apply_async')
+    def test_tokens_queued_again_once_refreshed(self, apply_async, refresh_all):
+        tasks.refresh_expiring_tokens()
+        pks = list(Token.objects.values_list('pk', flat=True))
+        tasks.refresh_tokens(pks[:1])
+        self.assertEqual(tasks.refresh_expiring_tokens(), 1)
+
+
+class RefreshAllTestCase(TestCase):
+    def setUp(self):
+        self.slow, self.broken = [Token.objects.create(
+            character_id=character_id, character_name='Character', character_owner_hash='hash', access_token='access',
+            refresh_token='refresh') for character_id in range(2)]
+
+    def test_refreshed_tokens_saved_on_error(self):
+        def refresh(token, session=None, auth=None, commit=True):
+            if token.pk == self.broken.pk:
+                raise ImproperlyConfigured()
+            # still in flight when the other refresh fails
+            time.sleep(0.2)
+            token.access_token = 'refreshed'
+
+        with mock.patch.object(Token, 'refresh', autospec=True, side_effect=refresh):
+            with self.assertRaises(ImproperlyConfigured):
+                Token.objects.all().refresh_all(max_workers=2)
+        self.assertEqual(Token.objects.get(pk=self.slow.pk).access_token, 'refreshed')
+        self.assertTrue(Token.objects.filter(pk=self.broken.pk).exists())
+
+
+class IdBatcherTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.requested = []
+
+        def post_universe_names(ids):
+            self.requested.append(list(ids))
+            if any(i < 0 for i in ids):
+                raise HTTPNotFound(mock.Mock(status_code=404))
+            return mock.Mock(result=lambda: [{'id': i, 'name': str(i)} for i in ids])
+        client = mock.Mock()
+        client.Universe.post_universe_names.side_effect = post_universe_names
+        self.batcher = IdBatcher('post_universe_names', 'ids', lambda result: ((i['id'], i) for i in result),
+                                 client=client)
+
+    def test_rejected_values_cached(self):
+        self.assertEqual(sorted(self.batcher.resolve([1, 2, -3, 4])), [1, 2, 4])
+        self.requested = []
+        self.assertEqual(sorted(self.batcher.resolve([1, 2, -3, 4])), [1, 2, 4])
+        self.assertEqual(self.requested, [])
+        self.assertEqual(sorted(self.batcher.resolve([-3, 5])), [5])
+        self.assertEqual(self.requested, [[5]])
+
+
+def _refresh(token, session=None, auth=None, commit=True):
+    token.created = timezone.now()
+    token.expires_at = token.created + timedelta(seconds=app_settings.ESI_TOKEN_VALID_DURATION)
+
+
+class TokenIndexTestCase(TestCase):
+    """
+    Checks token queries against enough tokens for the database to prefer its indexes over scanning the table
+    """
+    TOKEN_COUNT = 100000
+    CHARACTER_COUNT = 20000
+    EXPIRED = 500
+    EXPIRING = 300
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.now = timezone.now()
+        Token.objects.bulk_create([Token(
+            character_id=i % cls.CHARACTER_COUNT, character_name='Character', character_owner_hash='hash',
+            access_token='access', refresh_token='refresh', expires_at=cls.now + timedelta(seconds=cls._expires_in(i)),
+            scopes_fingerprint=scopes_fingerprint(['x.{0}'.format(i // cls.CHARACTER_COUNT % 2)]))
+            for i in range(cls.TOKEN_COUNT)])
+        # tokens saved without an expiry fall back to their creation time
+        Token.objects.bulk_create([Token(
+            character_id=i, character_name='Character', character_owner_hash='hash', access_token='access',
+            refresh_token='refresh') for i in range(10)])
+        cls.old_unindexed = list(Token.objects.filter(expires_at__isnull=True).values_list('pk', flat=True)[:5])
+        Token.objects.filter(pk__in=cls.old_unindexed).update(
+            created=cls.now - timedelta(seconds=app_settings.ESI_TOKEN_VALID_DURATION + 1))
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    @classmethod
+    def _expires_in(cls, i):
+        # away from the boundaries of the windows queried, as time passes during the tests
+        if i < cls.EXPIRED:
+            return -60 - i
+        if i < cls.EXPIRED + cls.EXPIRING:
+            return 60 + (i - cls.EXPIRED) % 180
+        return 3600 + i
+
+    def assertUsesIndex(self, queryset, column):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Token._meta.db_table)
+        names = [name for name, c in constraints.items() if c['index'] and c['columns'] == [column]]
+        plan = queryset.explain()
+        self.assertTrue(any(name in plan for name in names), 'no index on {0} in plan:\n{1}'.format(column, plan))
+
+    def test_get_expired(self):
+        expired = Token.objects.all().get_expired()
+        self.assertEqual(expired.count(), self.EXPIRED + len(self.old_unindexed))
+        # tokens without an expiry are matched by the NULL entries of the expiry index, then their creation time
+        self.assertTrue(set(self.old_unindexed) <= set(expired.values_list('pk', flat=True)))
+        self.assertUsesIndex(expired, 'expires_at')
+
+    def test_get_expiring(self):
+        # walks the expiry index in order instead of sorting the matched tokens
+        expiring = Token.objects.all().get_expiring(self.EXPIRING)
+        self.assertEqual(expiring.count(), self.EXPIRED + self.EXPIRING + len(self.old_unindexed))
+        self.assertUsesIndex(expiring, 'expires_at')
+
+    @mock.patch.object(Token, 'refresh', autospec=True, side_effect=_refresh)
+    def test_require_valid(self, refresh):
+        tokens = Token.objects.filter(character_id__lt=10)
+        expired = set(tokens.get_expired().values_list('pk', flat=True))
+        valid = tokens.require_valid()
+        self.assertTrue(expired)
+        self.assertEqual(set(c[0][0].pk for c in refresh.call_args_list), expired)
+        self.assertEqual(valid.count(), tokens.count())
+        self.assertUsesIndex(Token.objects.all()._expiring_before(self.now), 'expires_at')
+        self.assertUsesIndex(Token.objects.all().require_valid(), 'expires_at')
+
+    def test_equivalent_to(self):
+        token = Token.objects.filter(character_id=7).first()
+        equivalent = Token.objects.all().equivalent_to(token)
+        expected = Token.objects.filter(character_id=7, scopes_fingerprint=token.scopes_fingerprint).exclude(
+            pk=token.pk)
+        self.assertEqual(set(equivalent), set(expected))
+        # tokens of the character alternate between two sets of scopes
+        self.assertEqual(len(expected), 2)
+        self.assertUsesIndex(equivalent, 'character_id')
@@ -0,0 +1,94 @@
+"""
+Paces requests according to the ESI error limit shared by all processes on this host.
+ESI bans the IP once the error budget is exhausted, so requests are slowed as it shrinks
+and paused until it resets when nearly exhausted.
+"""
+from __future__ import unicode_literals
+from django.core.cache import cache
+from esi import app_settings
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+ERROR_LIMIT_CACHE_KEY = 'esi_error_limit'
+
+# how long a process relies on its copy of the error limit before reading it from the cache again
+LOCAL_STATE_DURATION = 1
+
+_local = {'state': None, 'read_at': 0}
+_local_lock = threading.Lock()
+
+
+def get_error_limit():
+    """
+    Retrieves the last reported error limit
+    :return: tuple of (errors remaining, reset timestamp), or None if unknown or reset
+    """
+    with _local_lock:
+        if _local['read_at'] + LOCAL_STATE_DURATION <= time.time():
+            _local['state'] = cache.get(ERROR_LIMIT_CACHE_KEY)
+            _local['read_at'] = time.time()
+        state = _local['state']
+    if state and state[1] <= time.time():
+        return None
+    return state
+
+
+def record_error_limit(response):
+    """
+    Shares the error limit reported in a response with all processes.
+    Only written when the remaining errors change, so ordinary responses don't write to the cache.
+    :param response: :class:`bravado_core.response.IncomingResponse`
+    """
+    try:
+        remain = int(response.headers['X-ESI-Error-Limit-Remain'])
+        reset = int(response.headers['X-ESI-Error-Limit-Reset'])
+    except (KeyError, ValueError, TypeError):
+        if response.status_code != 420:
+            return
+        # error limited responses may lack the headers, assume a full window
+        remain, reset = 0, 60
+    current = get_error_limit()
+    if current and current[0] == remain:
+        return
+    state = (remain, time.time() + reset)
+    cache.set(ERROR_LIMIT_CACHE_KEY, state, reset + 1)
+    with _local_lock:
+        _local['state'] = state
+        _local['read_at'] = time.time()
+    if remain < app_settings.ESI_ERROR_LIMIT_SLOWDOWN:
+        logger.warning("ESI error limit at {0} remaining, resets in {1}s.".format(remain, reset))
+
+
+def get_throttle_delay():
+    """
+    Determines how long to wait before sending a request.
+    No delay while the remaining errors are above ESI_ERROR_LIMIT_SLOWDOWN, growing linearly to waiting
+    for the reset once ESI_ERROR_LIMIT_PAUSE or fewer remain.
+    :return: seconds to wait
+    """
+    if not app_settings.ESI_ERROR_LIMIT_THROTTLE:
+        return 0
+    state = get_error_limit()
+    if not state:
+        return 0
+    remain, reset_at = state
+    slowdown, pause = app_settings.ESI_ERROR_LIMIT_SLOWDOWN, app_settings.ESI_ERROR_LIMIT_PAUSE
+    if remain >= slowdown:
+        return 0
+    until_reset = max(reset_at - time.time(), 0)
+    if remain <= pause:
+        return until_reset
+    return until_reset * (slowdown - remain) / float(slowdown - pause)
+
+
+def wait_for_error_limit():
+    """
+    Blocks until a request may be sent
+    """
+    delay = get_throttle_delay()
+    if delay > 0:
+        logger.debug("Delaying ESI request {0:.2f}s for error limit.".format(delay))
+        time.sleep(delay)
@@ -17,6 +17,9 @@ setup(
         'bravado>=8.4.0,<10.0',
         'celery>=4.0.2',
     ],
+    extras_require={
+        'async': ['aiohttp>=3.0'],
+    },
     packages=find_packages(),
     include_package_data=True,
     license='GNU General Public License v3 (GPLv3)',